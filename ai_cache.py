@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+AI生成結果のキャッシュモジュール
+同じ学習コンテンツの定型プロンプト（コンテンツタイプ別のテンプレート）は生徒間でほぼ同一になるため、
+生成結果をプロセス内にキャッシュしてGeminiの待ち時間と利用枠を節約する
+（自由入力のチャット等、ポリシーで許可されていないコンテンツタイプはキャッシュしない）
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# キャッシュの既定の有効秒数（0でキャッシュ全体を無効化）と最大件数
+AI_CACHE_TTL = int(os.environ.get('AI_CACHE_TTL', '3600'))
+AI_CACHE_MAX_SIZE = int(os.environ.get('AI_CACHE_MAX_SIZE', '500'))
+
+# コンテンツタイプ別のキャッシュ有効秒数（ここに無いコンテンツタイプはキャッシュしない）
+# None は AI_CACHE_TTL を使う。0 は明示的にキャッシュしない
+AI_CACHE_POLICIES = {
+    '動画・映像制作': None,
+    'ブログ・文章': None,
+    'ゲーム・アプリ': None,
+    'アート・工作': None,
+    '実験・観察': None,
+    'プログラミング・データ分析': None,
+    '創作活動（小説・漫画）': None,
+    '音楽制作': None,
+    # AIアシスタントのチャットは会話ごとに内容が異なるためキャッシュしない
+    'Learning Assistant': 0,
+}
+
+
+def _normalize_text(value):
+    """空白の違いを無視するため、連続する空白を1つにまとめる"""
+    return ' '.join(str(value).split()) if value is not None else ''
+
+
+def cache_ttl_for(content_type, identifier):
+    """コンテンツタイプのキャッシュ有効秒数を返す（0はキャッシュしない）"""
+    if AI_CACHE_TTL <= 0 or AI_CACHE_MAX_SIZE <= 0:
+        return 0
+    # 学習項目に紐づくテンプレートプロンプトのみ対象
+    if not identifier:
+        return 0
+    ttl = AI_CACHE_POLICIES.get(content_type, 0)
+    return AI_CACHE_TTL if ttl is None else ttl
+
+
+def make_cache_key(prompt, content_type, identifier, catalog_version, model_name=''):
+    """プロンプト構築の入力から正規化したキャッシュキー（SHA-256）を作成
+
+    学習内容はサーバー側でカタログから組み立てるため、識別子とカタログのバージョンをキーに含める
+    （学習データが更新されると自動的に別のキーになる）
+    """
+    canonical = {
+        'model': model_name,
+        'prompt': _normalize_text(prompt),
+        'content_type': _normalize_text(content_type),
+        'identifier': identifier or '',
+        'catalog_version': catalog_version or ''
+    }
+    encoded = json.dumps(canonical, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class AIResponseCache:
+    """有効期限・件数上限（LRU）付きのAI生成結果キャッシュ"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()  # key -> (有効期限, テキスト)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """キャッシュされたテキストを返す（無い・期限切れの場合はNone）"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, text, ttl):
+        """テキストをttl秒間キャッシュ（上限を超えた分は古いものから削除）"""
+        if ttl <= 0 or not text:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, text)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """キャッシュの利用状況"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxSize': self.max_size,
+                'ttl': AI_CACHE_TTL,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hitRate': round(self.hits / lookups, 4) if lookups else None
+            }
+
+
+# プロセス全体で共有するキャッシュ
+ai_response_cache = AIResponseCache(AI_CACHE_MAX_SIZE)
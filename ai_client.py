@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+AI生成クライアントモジュール
+Geminiのモデルをワーカーごとに1回だけ作成して使い回す（スレッド間で共有）
+AI_BACKEND=stub でGeminiを呼ばずに一定時間待って定型文を返すスタブに切り替えられる（負荷試験・オフライン計測用）
+"""
+
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from startup import startup_report
+
+# 使用するGeminiモデル
+GEMINI_MODEL_NAME = 'gemini-2.5-flash'
+GEMINI_API_BASE = 'https://generativelanguage.googleapis.com/v1beta'
+
+
+class GeminiBackend:
+    """google.generativeaiのモデルを1回だけ作成して使い回すバックエンド"""
+
+    name = 'gemini'
+
+    def __init__(self, api_key, model_name=GEMINI_MODEL_NAME):
+        self.api_key = api_key
+        self.model_name = model_name
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _get_model(self):
+        """モデルを取得（初回のみimport・設定・作成）"""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    # google.generativeaiは読み込みが重いため、初回利用時（またはウォームアップ時）にimportする
+                    with startup_report.step('import: google.generativeai (lazy)'):
+                        import google.generativeai as genai
+                    genai.configure(api_key=self.api_key)
+                    self._model = genai.GenerativeModel(self.model_name)
+        return self._model
+
+    def generate(self, prompt):
+        """プロンプトを実行して生成テキストを返す"""
+        response = self._get_model().generate_content(prompt)
+        return response.text if response else None
+
+    def generate_stream(self, prompt):
+        """プロンプトを実行し、生成されたテキストを逐次返す"""
+        for chunk in self._get_model().generate_content(prompt, stream=True):
+            text = chunk.text
+            if text:
+                yield text
+
+    def check_api_key(self, api_key, timeout=10):
+        """任意のAPIキーの有効性を確認（共有モデルのAPIキー設定は変更しない）
+
+        モデル情報の取得APIを直接呼ぶため、生成の利用枠も消費しない。
+        無効な場合はAPIのエラー内容を含む例外を送出する。
+        """
+        url = f"{GEMINI_API_BASE}/models/{self.model_name}"
+        request = urllib.request.Request(url, headers={'x-goog-api-key': api_key})
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                return json.loads(response.read()).get('name') is not None
+        except urllib.error.HTTPError as e:
+            raise RuntimeError(e.read().decode('utf-8', 'replace') or str(e)) from None
+
+    def warm_up(self):
+        """import・モデル作成とAPIへの接続を事前に済ませる（生成の利用枠は消費しない）"""
+        self._get_model().count_tokens('warm-up')
+
+
+class StubBackend:
+    """Geminiを呼ばずに、指定秒数待ってから定型文を返すバックエンド"""
+
+    name = 'stub'
+    model_name = 'stub'
+
+    def __init__(self, latency, chunk_count=8):
+        self.latency = latency
+        self.chunk_count = chunk_count
+
+    def _text(self, prompt):
+        return f"（スタブ応答）プロンプト {len(prompt)} 文字を受け付けました。小さな一歩から、自分のペースで進めていきましょう。"
+
+    def generate(self, prompt):
+        time.sleep(self.latency)
+        return self._text(prompt)
+
+    def generate_stream(self, prompt):
+        text = self._text(prompt)
+        size = max(1, -(-len(text) // self.chunk_count))
+        for start in range(0, len(text), size):
+            time.sleep(self.latency / self.chunk_count)
+            yield text[start:start + size]
+
+    def check_api_key(self, api_key, timeout=10):
+        time.sleep(min(self.latency, timeout))
+        return True
+
+    def warm_up(self):
+        pass
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_ai_backend():
+    """ワーカーで共有するAIバックエンドを取得（GeminiのAPIキー未設定の場合はNone）
+
+    環境変数は初回呼び出し時に読む（load_dotenv()の後に呼ばれるようにするため）
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if os.environ.get('AI_BACKEND', 'gemini') == 'stub':
+                    _backend = StubBackend(float(os.environ.get('AI_STUB_LATENCY', '2.0')))
+                    print(f"[AI] スタブバックエンドを使用（応答時間 {_backend.latency}秒）")
+                elif os.environ.get('GEMINI_API_KEY'):
+                    _backend = GeminiBackend(os.environ['GEMINI_API_KEY'])
+    return _backend
+
+
+def start_ai_warmup():
+    """AIバックエンドのウォームアップをバックグラウンドで開始（AI_WARMUP=0で無効）"""
+    if os.environ.get('AI_WARMUP', '1') != '1':
+        return None
+    backend = get_ai_backend()
+    if backend is None:
+        return None
+
+    def run():
+        started = time.perf_counter()
+        try:
+            backend.warm_up()
+            startup_report.record('AI client warm-up', time.perf_counter() - started)
+        except Exception as e:
+            print(f"[AI] WARNING: ウォームアップに失敗しました（初回の生成時に再接続します）: {e}")
+
+    thread = threading.Thread(target=run, name='ai-warmup', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+AI生成の実行モジュール
+Gemini呼び出しを専用のスレッドプールで実行し、同時実行数と待ち行列を制限する
+（AI生成が長引いても、カタログ表示や進捗保存を処理するスレッドを使い切らない）
+同一プロンプトの同時リクエストは1回の呼び出しに合流させる
+"""
+
+import os
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class AIBusyError(Exception):
+    """AI生成の同時実行数と待ち行列が上限に達している"""
+
+
+class AIExecutor:
+    """同時実行数・待ち行列の上限付きでAI生成を実行するスレッドプール"""
+
+    def __init__(self, max_concurrency, max_queue):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='ai-worker')
+        # 実行中 + 待機中の合計がこの上限を超える場合は即座に拒否
+        self._capacity = threading.BoundedSemaphore(max_concurrency + max_queue)
+
+    def acquire_slot(self):
+        """実行枠を1つ確保（上限に達している場合はAIBusyError）。使い終わったらrelease_slot()を呼ぶこと"""
+        if not self._capacity.acquire(blocking=False):
+            raise AIBusyError()
+
+    def release_slot(self):
+        self._capacity.release()
+
+    def submit(self, fn, *args, **kwargs):
+        """fnをスレッドプールで実行（上限に達している場合はAIBusyError）"""
+        self.acquire_slot()
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self.release_slot()
+            raise
+        future.add_done_callback(lambda _: self.release_slot())
+        return future
+
+    def run(self, fn, *args, timeout=None, **kwargs):
+        """fnをスレッドプールで実行して結果を待つ（timeout秒で TimeoutError）"""
+        return self.submit(fn, *args, **kwargs).result(timeout=timeout)
+
+    def stream(self, fn, *args, timeout=None, **kwargs):
+        """ジェネレータ関数fnをスレッドプールで実行し、生成された値を逐次返すイテレータを返す
+
+        上限に達している場合は呼び出し時点でAIBusyErrorを送出する。
+        timeout秒以上次の値が届かない場合は TimeoutError。
+        イテレータが途中で閉じられた場合（クライアント切断等）は生成を打ち切る。
+        """
+        items = queue.Queue()
+        cancelled = threading.Event()
+
+        def produce():
+            try:
+                for item in fn(*args, **kwargs):
+                    if cancelled.is_set():
+                        return
+                    items.put(('item', item))
+                items.put(('done', None))
+            except Exception as e:
+                items.put(('error', e))
+
+        self.submit(produce)
+
+        def iterate():
+            try:
+                while True:
+                    try:
+                        kind, value = items.get(timeout=timeout)
+                    except queue.Empty:
+                        raise TimeoutError('AI generation timed out')
+                    if kind == 'item':
+                        yield value
+                    elif kind == 'done':
+                        return
+                    else:
+                        raise value
+            finally:
+                cancelled.set()
+
+        return iterate()
+
+
+class SingleFlight:
+    """同一キーの処理が実行中なら、新たに実行せずその結果を待って共有する（リクエストの合流）
+
+    slotsを指定した場合、結果を待つリクエスト（follower）もその実行枠を1つ使う
+    （待機中もリクエスト処理スレッドを占有するため、AI関連のスレッド数を実行プールの上限内に収める）
+    """
+
+    def __init__(self, slots=None):
+        self.slots = slots
+        self._flights = {}  # key -> Future
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+        self.rejected = 0
+
+    def begin(self, key):
+        """(future, leaderかどうか) を返す。leaderは処理後に必ずfinish()を呼ぶこと
+
+        followerは確保した実行枠をwait()またはrelease()で解放すること（枠が無い場合はAIBusyError）
+        """
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                if self.slots is not None:
+                    try:
+                        self.slots.acquire_slot()
+                    except AIBusyError:
+                        self.rejected += 1
+                        raise
+                self.followers += 1
+                return future, False
+            future = Future()
+            self._flights[key] = future
+            self.leaders += 1
+            return future, True
+
+    def finish(self, key, future, result=None, error=None):
+        """leaderの処理結果を待機中のリクエストに渡し、キーを解放（2回目以降の呼び出しは無視）"""
+        with self._lock:
+            if self._flights.get(key) is future:
+                del self._flights[key]
+            if future.done():
+                return
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def release(self):
+        """followerが確保した実行枠を解放"""
+        if self.slots is not None:
+            self.slots.release_slot()
+
+    def wait(self, future, timeout=None):
+        """followerとしてleaderの結果を待ち、確保した実行枠を解放（timeout秒で TimeoutError）"""
+        try:
+            return future.result(timeout=timeout)
+        finally:
+            self.release()
+
+    def do(self, key, fn, *args, timeout=None, **kwargs):
+        """fnを実行（同一キーが実行中ならその結果を待つ）。(結果, 合流したかどうか) を返す"""
+        future, leader = self.begin(key)
+        if not leader:
+            return self.wait(future, timeout=timeout), True
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            self.finish(key, future, error=e)
+            raise
+        self.finish(key, future, result=result)
+        return result, False
+
+    def stats(self):
+        with self._lock:
+            return {'inFlight': len(self._flights), 'leaders': self.leaders, 'followers': self.followers,
+                    'rejected': self.rejected}
+
+
+# プロセス全体で共有するAI実行プール
+ai_executor = AIExecutor(
+    max_concurrency=int(os.environ.get('AI_MAX_CONCURRENCY', '3')),
+    max_queue=int(os.environ.get('AI_MAX_QUEUE', '2'))
+)
+
+# 同一プロンプトの同時リクエストを1回のGemini呼び出しにまとめる（待機中のリクエストもAI実行プールの枠を使う）
+ai_single_flight = SingleFlight(slots=ai_executor)
+
+# AI生成1回あたりの最大待ち時間（秒）。gunicornの--timeoutより短くする
+AI_TIMEOUT = float(os.environ.get('AI_TIMEOUT', '90'))
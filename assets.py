@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+静的アセットのフィンガープリントモジュール
+build_static.py が作成した static/dist/ 内の内容ハッシュ付きファイル（style.<ハッシュ>.css 等）と
+マニフェスト（static/dist/manifest.json）を使い、テンプレートの asset_url() でハッシュ付きのURLを返す。
+ハッシュ付きファイルは内容が変わるとURLも変わるため、1年間・immutableでキャッシュさせる
+（再訪問時、変更されていないアセットへのリクエストは発生しない）
+"""
+
+import json
+import os
+
+from flask import request, url_for
+
+ASSETS_FINGERPRINT = os.environ.get('ASSETS_FINGERPRINT', '1') == '1'
+
+# ハッシュ付きファイルの出力先（static/ からの相対パス）とマニフェストのファイル名
+ASSET_DIST_DIR = 'dist'
+ASSET_MANIFEST_NAME = 'manifest.json'
+
+# ハッシュ付きファイルのキャッシュ期間（秒）
+ASSET_IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# 元のファイル名 -> ハッシュ付きファイルのパス（static/ からの相対パス）
+_asset_manifest = {}
+
+
+def load_asset_manifest(static_folder):
+    """マニフェストを読み込む（元ファイルの方が新しいエントリは、ビルド後に編集されたものとして除外）"""
+    path = os.path.join(static_folder, ASSET_DIST_DIR, ASSET_MANIFEST_NAME)
+    try:
+        with open(path, encoding='utf-8') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"[STARTUP] WARNING: アセットマニフェストを読み込めません: {e}")
+        return {}
+
+    fresh = {}
+    for name, hashed in manifest.items():
+        source = os.path.join(static_folder, name)
+        built = os.path.join(static_folder, hashed)
+        if not os.path.isfile(built):
+            continue
+        if os.path.isfile(source) and os.path.getmtime(source) > os.path.getmtime(built):
+            print(f"[STARTUP] WARNING: {name} がビルド後に変更されているため元ファイルを使用します（build_static.py を再実行してください）")
+            continue
+        fresh[name] = hashed
+    return fresh
+
+
+def asset_url(filename):
+    """テンプレート用: 静的ファイルのURL（ハッシュ付きファイルがあればそちらを返す）"""
+    return url_for('static', filename=_asset_manifest.get(filename, filename))
+
+
+def _is_fingerprinted(filename):
+    """static/dist/ 内のハッシュ付きファイルか（マニフェスト自体は除く）"""
+    return filename.startswith(ASSET_DIST_DIR + '/') and filename != f"{ASSET_DIST_DIR}/{ASSET_MANIFEST_NAME}"
+
+
+def set_immutable_cache(response):
+    """after_request: ハッシュ付きファイルを長期間・immutableでキャッシュさせる"""
+    if (request.endpoint == 'static' and response.status_code in (200, 304)
+            and _is_fingerprinted((request.view_args or {}).get('filename', ''))):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = ASSET_IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+
+def init_assets(app):
+    """Flaskアプリにフィンガープリント付きアセットを設定（ASSETS_FINGERPRINT=0で元ファイルを使用）"""
+    app.add_template_global(asset_url)
+    app.after_request(set_immutable_cache)
+    if not ASSETS_FINGERPRINT:
+        return
+    _asset_manifest.update(load_asset_manifest(app.static_folder))
+    if _asset_manifest:
+        print(f"[STARTUP] フィンガープリント付きアセットを使用: {len(_asset_manifest)}件")
+    else:
+        print("[STARTUP] アセットマニフェストが無いため元の静的ファイルを使用します（build_static.py で作成）")
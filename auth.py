@@ -1,9 +1,59 @@
+import os
+import threading
+import time
 import bcrypt
-from flask import session, g
+from flask import session, g, has_request_context
 from flask_login import UserMixin
 from datetime import datetime, timedelta
 from database import db_manager
 
+# ユーザー情報のキャッシュ（user_id → (有効期限, usersの行)）
+# 利用回数・プレミアム状態を変更する操作では必ず invalidate_user_cache を呼ぶ
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', '30'))
+USER_CACHE_MAX_SIZE = 5000
+USER_COLUMNS = 'id, email, is_premium, premium_expires_at, free_usage_count, last_reset_date'
+
+# 無料プランの月間AI利用回数の上限
+FREE_USAGE_LIMIT = 30
+_user_cache = {}
+_user_cache_lock = threading.Lock()
+
+def _get_cached_user_row(user_id):
+    """キャッシュからユーザーの行を取得（期限切れ・未登録ならNone）"""
+    entry = _user_cache.get(user_id)
+    if entry and entry[0] > time.monotonic():
+        return entry[1]
+    return None
+
+def _cache_user_row(user_data):
+    """ユーザーの行をキャッシュに保存"""
+    if USER_CACHE_TTL <= 0:
+        return
+    row = {
+        'id': user_data['id'],
+        'email': user_data['email'],
+        'is_premium': user_data['is_premium'],
+        'premium_expires_at': user_data['premium_expires_at'],
+        'free_usage_count': user_data['free_usage_count'],
+        'last_reset_date': user_data['last_reset_date']
+    }
+    now = time.monotonic()
+    with _user_cache_lock:
+        if len(_user_cache) >= USER_CACHE_MAX_SIZE:
+            # 期限切れを削除しても上限を超える場合は全て破棄
+            for key in [key for key, (expires, _) in _user_cache.items() if expires <= now]:
+                del _user_cache[key]
+            if len(_user_cache) >= USER_CACHE_MAX_SIZE:
+                _user_cache.clear()
+        _user_cache[row['id']] = (now + USER_CACHE_TTL, row)
+
+def invalidate_user_cache(user_id):
+    """ユーザーのキャッシュを破棄（利用回数・プレミアム状態の変更後に呼ぶ）"""
+    with _user_cache_lock:
+        _user_cache.pop(user_id, None)
+    if has_request_context():
+        g.pop('current_user', None)
+
 class User(UserMixin):
     def __init__(self, id, email, is_premium=False, premium_expires_at=None, free_usage_count=0, last_reset_date=None):
         self.id = id
@@ -13,24 +63,33 @@ class User(UserMixin):
         self.free_usage_count = free_usage_count
         self.last_reset_date = last_reset_date
         
-        # プレミアム期限チェック
+        # プレミアム期限チェック（読み取りのみ。DBの更新はmaintenance.pyが一括で行う）
         self.check_premium_expiry()
 
+    @staticmethod
+    def _from_row(user_data):
+        """usersの行からUserを作成"""
+        return User(
+            id=user_data['id'],
+            email=user_data['email'],
+            is_premium=bool(user_data['is_premium']),
+            premium_expires_at=user_data['premium_expires_at'],
+            free_usage_count=user_data['free_usage_count'],
+            last_reset_date=user_data['last_reset_date']
+        )
+
     @staticmethod
     def get(user_id):
-        """ユーザーIDからユーザー情報を取得"""
+        """ユーザーIDからユーザー情報を取得（短時間キャッシュ付き）"""
         try:
-            user_data = db_manager.execute_single('SELECT * FROM users WHERE id = %s', (user_id,))
+            user_data = _get_cached_user_row(user_id)
+            if user_data is None:
+                user_data = db_manager.execute_single(f'SELECT {USER_COLUMNS} FROM users WHERE id = %s', (user_id,))
+                if user_data:
+                    _cache_user_row(user_data)
             
             if user_data:
-                return User(
-                    id=user_data['id'],
-                    email=user_data['email'],
-                    is_premium=bool(user_data['is_premium']),
-                    premium_expires_at=user_data['premium_expires_at'],
-                    free_usage_count=user_data['free_usage_count'],
-                    last_reset_date=user_data['last_reset_date']
-                )
+                return User._from_row(user_data)
             return None
         except Exception as e:
             print(f"[AUTH] Error getting user: {e}")
@@ -40,17 +99,12 @@ class User(UserMixin):
     def get_by_email(email):
         """メールアドレスからユーザー情報を取得"""
         try:
-            user_data = db_manager.execute_single('SELECT * FROM users WHERE email = %s', (email,))
+            user_data = db_manager.execute_single(f'SELECT {USER_COLUMNS} FROM users WHERE email = %s', (email,))
             
             if user_data:
-                return User(
-                    id=user_data['id'],
-                    email=user_data['email'],
-                    is_premium=bool(user_data['is_premium']),
-                    premium_expires_at=user_data['premium_expires_at'],
-                    free_usage_count=user_data['free_usage_count'],
-                    last_reset_date=user_data['last_reset_date']
-                )
+                # ログイン直後の User.get でDBを引かないようにキャッシュしておく
+                _cache_user_row(user_data)
+                return User._from_row(user_data)
             return None
         except Exception as e:
             print(f"[AUTH] Error getting user by email: {e}")
@@ -133,70 +187,62 @@ class User(UserMixin):
             traceback.print_exc()
             return False
 
-    def check_usage_limit(self):
-        """無料プランの利用制限をチェック"""
-        print(f"[DEBUG] check_usage_limit: is_premium={self.is_premium}, usage_count={self.free_usage_count}")
-        
-        # プレミアムユーザーは常に利用可能
-        if self.is_premium:
-            print("[DEBUG] Premium user - unlimited access")
-            return True
-        
-        # 月が変わったらカウントリセット
-        today = datetime.now().date()
-        if self.last_reset_date:
-            if isinstance(self.last_reset_date, str):
-                last_reset = datetime.strptime(self.last_reset_date, '%Y-%m-%d').date()
-            else:
-                last_reset = self.last_reset_date
-            
-            if today.month != last_reset.month or today.year != last_reset.year:
-                print("[DEBUG] Monthly usage reset required")
-                self.reset_usage_count()
-                return True
-        
-        # 無料ユーザーは30回まで利用可能
-        result = self.free_usage_count < 30
-        print(f"[DEBUG] Free user limit check: {self.free_usage_count}/30 - allowed: {result}")
-        return result
+    def reserve_usage(self):
+        """AI生成1回分の利用枠を予約（月次リセット・上限チェック・カウントアップを1回のUPDATEで実行）
 
-    def increment_usage_count(self):
-        """利用回数をカウントアップ（プレミアムユーザーでも使用量把握のためカウント）"""
-        try:
-            with db_manager.get_connection() as conn:
-                with conn.cursor() as cur:
-                    cur.execute(
-                        'UPDATE users SET free_usage_count = free_usage_count + 1 WHERE id = %s',
-                        (self.id,)
+        同時リクエストでも行ロックにより上限を超えない。予約できた場合はTrue、上限に達している場合はFalse。
+        生成に失敗した場合は release_usage() で予約を取り消すこと。
+        """
+        now = datetime.now()
+        today = now.date()
+        with db_manager.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE users SET
+                        free_usage_count = CASE
+                            WHEN COALESCE(last_reset_date, created_at::date) < %(month_start)s THEN 1
+                            ELSE free_usage_count + 1
+                        END,
+                        last_reset_date = CASE
+                            WHEN COALESCE(last_reset_date, created_at::date) < %(month_start)s THEN %(today)s
+                            ELSE last_reset_date
+                        END
+                    WHERE id = %(id)s AND (
+                        (is_premium AND (premium_expires_at IS NULL OR premium_expires_at > %(now)s))
+                        OR COALESCE(last_reset_date, created_at::date) < %(month_start)s
+                        OR free_usage_count < %(limit)s
                     )
-                    conn.commit()
-            
-            self.free_usage_count += 1
-            
-            if self.is_premium:
-                print(f"[DEBUG] Premium user usage tracked: {self.free_usage_count} (unlimited)")
-            else:
-                print(f"[DEBUG] Free user usage incremented: {self.free_usage_count}/30")
-        except Exception as e:
-            print(f"[AUTH] Error incrementing usage count: {e}")
+                    RETURNING free_usage_count, last_reset_date
+                """, {'id': self.id, 'now': now, 'today': today,
+                      'month_start': today.replace(day=1), 'limit': FREE_USAGE_LIMIT})
+                row = cur.fetchone()
+                conn.commit()
+        invalidate_user_cache(self.id)
+        
+        if row is None:
+            print(f"[AUTH] 利用上限に達しています: user_id={self.id}")
+            self.free_usage_count = max(self.free_usage_count, FREE_USAGE_LIMIT)
+            return False
+        self.free_usage_count, self.last_reset_date = row
+        return True
 
-    def reset_usage_count(self):
-        """利用回数をリセット（月初処理）"""
+    def release_usage(self):
+        """reserve_usage() で予約した利用枠を取り消す（AI生成に失敗した場合）"""
         try:
-            today = datetime.now().date()
-            
             with db_manager.get_connection() as conn:
                 with conn.cursor() as cur:
-                    cur.execute(
-                        'UPDATE users SET free_usage_count = 0, last_reset_date = %s WHERE id = %s',
-                        (today, self.id)
-                    )
+                    cur.execute("""
+                        UPDATE users SET free_usage_count = free_usage_count - 1
+                        WHERE id = %s AND free_usage_count > 0
+                        RETURNING free_usage_count
+                    """, (self.id,))
+                    row = cur.fetchone()
                     conn.commit()
-            
-            self.free_usage_count = 0
-            self.last_reset_date = today
+            invalidate_user_cache(self.id)
+            if row is not None:
+                self.free_usage_count = row[0]
         except Exception as e:
-            print(f"[AUTH] Error resetting usage count: {e}")
+            print(f"[AUTH] Error releasing usage count: {e}")
 
     def activate_premium(self, activation_code):
         """プレミアムアカウントを有効化"""
@@ -225,6 +271,7 @@ class User(UserMixin):
                         )
                         
                         conn.commit()
+                        invalidate_user_cache(self.id)
                         
                         self.is_premium = True
                         self.premium_expires_at = premium_expires
@@ -245,6 +292,7 @@ class User(UserMixin):
                         (self.id,)
                     )
                     conn.commit()
+            invalidate_user_cache(self.id)
             
             self.is_premium = False
             self.premium_expires_at = None
@@ -254,7 +302,7 @@ class User(UserMixin):
             return False
 
     def check_premium_expiry(self):
-        """プレミアム期限をチェックして、期限切れの場合は自動解除"""
+        """プレミアム期限をチェックして、期限切れの場合は無料プランとして扱う（DBの解除は定期メンテナンスで実行）"""
         if self.is_premium and self.premium_expires_at:
             if isinstance(self.premium_expires_at, str):
                 expires_at = datetime.fromisoformat(self.premium_expires_at.replace('Z', '+00:00'))
@@ -263,13 +311,17 @@ class User(UserMixin):
             
             if datetime.now() > expires_at:
                 print(f"[AUTH] プレミアム期限切れ検出: {self.email}")
-                self.revoke_premium()
+                self.is_premium = False
 
 def get_current_user():
-    """現在のログインユーザーを取得"""
-    if 'user_id' in session:
-        return User.get(session['user_id'])
-    return None
+    """現在のログインユーザーを取得（同一リクエスト内では1回だけ取得）"""
+    if 'user_id' not in session:
+        return None
+    user = g.get('current_user')
+    if user is None or user.id != session['user_id']:
+        user = User.get(session['user_id'])
+        g.current_user = user
+    return user
 
 def login_required(f):
     """ログインが必要なページのデコレーター"""
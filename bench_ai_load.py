@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+AI負荷時のスループット計測スクリプト
+AI生成を同時に実行している間、他のエンドポイント（カタログ・進捗等）がどれだけ応答できるかを計測する
+
+使い方:
+    python bench_ai_load.py --base-url http://127.0.0.1:8000 --email user@example.com --password xxxx
+    python bench_ai_load.py --ai-path /api/ai-generate-test   # 認証なしのテスト用API
+
+Geminiを呼ばずに計測する場合は、サーバーをスタブバックエンドで起動する:
+    AI_BACKEND=stub AI_STUB_LATENCY=3 gunicorn study_app:app --worker-class gthread --threads 8
+"""
+
+import argparse
+import json
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.cookiejar import CookieJar
+
+
+def build_opener(base_url, email, password):
+    """（必要なら）ログイン済みのセッションCookieを持つopenerを作成"""
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+    if email and password:
+        request = urllib.request.Request(
+            f"{base_url}/login",
+            data=json.dumps({'email': email, 'password': password}).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}
+        )
+        with opener.open(request, timeout=30) as response:
+            if not json.loads(response.read()).get('success'):
+                raise SystemExit('ログインに失敗しました')
+    return opener
+
+
+def request_once(opener, url, body=None, timeout=130):
+    """1リクエストを実行し (成功したか, 秒数) を返す"""
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    request = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    started = time.perf_counter()
+    try:
+        with opener.open(request, timeout=timeout) as response:
+            response.read()
+            ok = 200 <= response.status < 400
+    except (urllib.error.URLError, OSError):
+        ok = False
+    return ok, time.perf_counter() - started
+
+
+def run_clients(opener, urls, clients, duration, body=None, stop_event=None):
+    """clients個のスレッドでurlsを順番に叩き続け、結果を集計"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(index):
+        i = index
+        while time.perf_counter() < deadline and not (stop_event and stop_event.is_set()):
+            ok, seconds = request_once(opener, urls[i % len(urls)], body)
+            i += 1
+            with lock:
+                if ok:
+                    latencies.append(seconds)
+                else:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, errors[0], time.perf_counter() - started)
+
+
+def summarize(latencies, errors, elapsed):
+    """スループット・レイテンシの集計"""
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput': len(latencies) / elapsed if elapsed else 0,
+        'p50_ms': statistics.median(latencies) * 1000 if latencies else None,
+        'p95_ms': latencies[int(len(latencies) * 0.95) - 1] * 1000 if latencies else None
+    }
+
+
+def print_summary(title, summary):
+    p50 = f"{summary['p50_ms']:.1f}" if summary['p50_ms'] is not None else '-'
+    p95 = f"{summary['p95_ms']:.1f}" if summary['p95_ms'] is not None else '-'
+    print(f"{title:<28} {summary['throughput']:8.1f} req/s  p50 {p50:>8} ms  p95 {p95:>8} ms  "
+          f"ok {summary['requests']}  errors {summary['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='AI負荷時の他エンドポイントのスループット計測')
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--email')
+    parser.add_argument('--password')
+    parser.add_argument('--paths', default='/api/subjects,/api/learning-item/8310213211100000,/api/progress-stats',
+                        help='計測対象のエンドポイント（カンマ区切り）')
+    parser.add_argument('--ai-path', default='/api/ai-generate')
+    parser.add_argument('--clients', type=int, default=8, help='計測対象への同時クライアント数')
+    parser.add_argument('--ai-clients', type=int, default=6, help='AI生成の同時リクエスト数')
+    parser.add_argument('--duration', type=float, default=20.0)
+    args = parser.parse_args()
+
+    opener = build_opener(args.base_url, args.email, args.password)
+    urls = [args.base_url + path for path in args.paths.split(',')]
+    ai_url = args.base_url + args.ai_path
+    ai_body = {'prompt': '今日の学習のコツを1つ教えてください', 'content_type': 'benchmark', 'context': {}}
+
+    print(f"[BENCH] 対象: {', '.join(args.paths.split(','))} / AI: {args.ai_path}")
+
+    baseline = run_clients(opener, urls, args.clients, args.duration)
+    print_summary('baseline (AI負荷なし)', baseline)
+
+    # AI生成を同時実行し続けながら計測
+    ai_result = {}
+    stop_ai = threading.Event()
+    ai_thread = threading.Thread(target=lambda: ai_result.update(
+        run_clients(opener, [ai_url], args.ai_clients, args.duration + 5, ai_body, stop_ai)
+    ))
+    ai_thread.start()
+    time.sleep(1.0)  # AIリクエストが実行中になるまで待つ
+    loaded = run_clients(opener, urls, args.clients, args.duration)
+    stop_ai.set()
+    ai_thread.join()
+
+    print_summary(f'with {args.ai_clients} AI requests', loaded)
+    print_summary('AI endpoint', ai_result)
+    if baseline['throughput']:
+        print(f"[BENCH] AI負荷時のスループット: baselineの {loaded['throughput'] / baseline['throughput'] * 100:.0f}%")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+静的ファイルのビルドスクリプト
+1. static/ 直下のCSS・JavaScriptを縮小し、内容ハッシュ付きのファイル（static/dist/style.<ハッシュ>.css 等）と
+   マニフェスト（static/dist/manifest.json）を作成する（テンプレートは assets.py の asset_url() で参照）
+2. static/ 内のCSS・JavaScript等の圧縮版（.gz、brotliがあれば .br）を最大圧縮レベルで事前に作成する
+   （実行時は compression.py が元ファイルより新しい圧縮版をそのまま返すため、リクエストごとに圧縮しない）
+
+デプロイ時（render.yamlのbuildCommand）に実行する。元ファイルを変更したら再実行すること
+"""
+
+import hashlib
+import json
+import os
+import re
+import sys
+
+# プロジェクトのパスを追加
+sys.path.append(os.path.dirname(__file__))
+
+from assets import ASSET_DIST_DIR, ASSET_MANIFEST_NAME
+from compression import COMPRESS_MIN_SIZE, PRECOMPRESSED_SUFFIXES, available_encodings, compress
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIR = os.path.join(STATIC_DIR, ASSET_DIST_DIR)
+
+# ファイル名に付ける内容ハッシュの桁数
+ASSET_HASH_LENGTH = 12
+
+# 事前圧縮する拡張子
+PRECOMPRESS_EXTENSIONS = ('.css', '.js', '.svg', '.html', '.json', '.txt')
+
+
+def _protect(literals, text):
+    """縮小の対象外にするリテラル（文字列等）をプレースホルダーに置き換える"""
+    literals.append(text)
+    return f"\x00{len(literals) - 1}\x00"
+
+
+def _restore(literals, text):
+    """プレースホルダーを元のリテラルに戻す"""
+    return re.sub(r'\x00(\d+)\x00', lambda m: literals[int(m.group(1))], text)
+
+
+# JavaScriptで直前がこれらの文字の場合、/ は正規表現リテラルの開始（それ以外は除算）
+_JS_REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^')
+_JS_REGEX_KEYWORDS = ('return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'void', 'delete', 'new', 'throw', 'yield', 'await')
+
+
+def _js_regex_allowed(out):
+    """出力済みのコードの末尾から、次の / が正規表現リテラルの開始かを判定"""
+    # 末尾の数要素だけを見る（キーワードの判定に足りる長さ）
+    tail = []
+    for chunk in reversed(out):
+        tail.append(chunk)
+        if len(''.join(tail).strip()) > 16:
+            break
+    code = ''.join(reversed(tail)).rstrip()
+    if not code:
+        return True
+    if code[-1] in _JS_REGEX_PRECEDERS:
+        return True
+    match = re.search(r'[A-Za-z_$][\w$]*$', code)
+    return match is not None and match.group(0) in _JS_REGEX_KEYWORDS
+
+
+def minify_js(source):
+    """JavaScriptを縮小（文字列・テンプレート・正規表現の外のコメントと行頭・行末の空白、空行を削除）
+
+    改行は残すため、自動セミコロン挿入に依存したコードの意味は変わらない
+    """
+    out = []
+    literals = []
+    i = 0
+    n = len(source)
+    # テンプレートリテラルの ${ } 内のネスト（各要素はその式内の { の深さ）
+    template_stack = []
+    while i < n:
+        c = source[i]
+        nxt = source[i + 1] if i + 1 < n else ''
+        if c == '/' and nxt == '/':
+            end = source.find('\n', i)
+            i = n if end == -1 else end
+        elif c == '/' and nxt == '*':
+            end = source.find('*/', i + 2)
+            comment = source[i:n if end == -1 else end + 2]
+            # 複数行のコメントは改行に置き換える（自動セミコロン挿入を維持）
+            out.append('\n' if '\n' in comment else ' ')
+            i += len(comment)
+        elif c in '"\'' or (c == '/' and _js_regex_allowed(out)):
+            # 文字列・正規表現リテラルはそのまま出力（正規表現の [...] 内の / は終端ではない）
+            j = i + 1
+            in_class = False
+            while j < n and source[j] != '\n':
+                if source[j] == '\\':
+                    j += 2
+                    continue
+                if c == '/' and source[j] == '[':
+                    in_class = True
+                elif c == '/' and source[j] == ']':
+                    in_class = False
+                elif source[j] == c and not in_class:
+                    break
+                j += 1
+            out.append(_protect(literals, source[i:j + 1]))
+            i = j + 1
+        elif c == '`' or (c == '}' and template_stack and template_stack[-1] == 0):
+            # テンプレートリテラルの文字列部分（次の ${ または終端の ` まで）はそのまま出力
+            if c == '}':
+                template_stack.pop()
+            j = i + 1
+            while j < n:
+                if source[j] == '\\':
+                    j += 2
+                    continue
+                if source[j] == '`':
+                    break
+                if source.startswith('${', j):
+                    template_stack.append(0)
+                    j += 1
+                    break
+                j += 1
+            out.append(_protect(literals, source[i:j + 1]))
+            i = j + 1
+        else:
+            if template_stack and c == '{':
+                template_stack[-1] += 1
+            elif template_stack and c == '}':
+                template_stack[-1] -= 1
+            out.append(c)
+            i += 1
+    # コード部分の行頭・行末の空白と空行を削除（リテラルは置き換えてあるため変更されない）
+    lines = (line.strip() for line in ''.join(out).split('\n'))
+    return _restore(literals, '\n'.join(line for line in lines if line) + '\n')
+
+
+def minify_css(source):
+    """CSSを縮小（文字列の外のコメントを削除し、空白を詰める）"""
+    literals = []
+    # 文字列はそのまま残し、コメントは削除
+    css = re.sub(r'"(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\'|/\*.*?\*/',
+                 lambda m: '' if m.group(0).startswith('/*') else _protect(literals, m.group(0)),
+                 source, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    # { } ; , の前後と宣言の : の後の空白は不要（: の前の空白はセレクタ（a :hover）で意味を持つため残す）
+    css = re.sub(r' ?([{};,]) ?', r'\1', css)
+    css = re.sub(r'([{;][-\w]+): ', r'\1:', css)
+    css = css.replace(';}', '}')
+    return _restore(literals, css.strip() + '\n')
+
+
+# 縮小・フィンガープリントの対象（拡張子: 縮小関数）
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+
+def fingerprint_assets():
+    """static/ 直下のCSS・JavaScriptを縮小してハッシュ付きのファイルとマニフェストを作成（戻り値: マニフェスト）"""
+    os.makedirs(DIST_DIR, exist_ok=True)
+    manifest = {}
+    for name in sorted(os.listdir(STATIC_DIR)):
+        base, ext = os.path.splitext(name)
+        path = os.path.join(STATIC_DIR, name)
+        if ext not in MINIFIERS or not os.path.isfile(path):
+            continue
+        with open(path, encoding='utf-8') as f:
+            source = f.read()
+        data = MINIFIERS[ext](source).encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()[:ASSET_HASH_LENGTH]
+        hashed = f"{base}.{digest}{ext}"
+        tmp_path = os.path.join(DIST_DIR, hashed + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, os.path.join(DIST_DIR, hashed))
+        manifest[name] = f"{ASSET_DIST_DIR}/{hashed}"
+        print(f"[BUILD] {name}: {len(source.encode('utf-8')):,} バイト → {hashed}: {len(data):,} バイト")
+
+    # 以前のビルドのハッシュ付きファイル（と圧縮版）を削除
+    current = {os.path.basename(hashed) for hashed in manifest.values()}
+    for name in os.listdir(DIST_DIR):
+        built = name
+        for _, suffix in PRECOMPRESSED_SUFFIXES:
+            if built.endswith(suffix):
+                built = built[:-len(suffix)]
+        if built != ASSET_MANIFEST_NAME and built not in current:
+            os.remove(os.path.join(DIST_DIR, name))
+
+    # マニフェストは最後に書き込む（書き込み前のファイルを参照しない）
+    tmp_path = os.path.join(DIST_DIR, ASSET_MANIFEST_NAME + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp_path, os.path.join(DIST_DIR, ASSET_MANIFEST_NAME))
+    return manifest
+
+
+def precompress_file(path):
+    """1ファイルの圧縮版を作成（戻り値: {圧縮形式: 圧縮後のサイズ}）"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    suffixes = dict(PRECOMPRESSED_SUFFIXES)
+    sizes = {}
+    for encoding in available_encodings():
+        compressed = compress(data, encoding, gzip_level=9, brotli_quality=11)
+        # 圧縮しても小さくならない場合は作成しない（古い圧縮版があれば削除）
+        variant = path + suffixes[encoding]
+        if len(compressed) >= len(data):
+            if os.path.exists(variant):
+                os.remove(variant)
+            continue
+        tmp_path = variant + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(compressed)
+        os.replace(tmp_path, variant)
+        sizes[encoding] = len(compressed)
+    return sizes
+
+
+def iter_static_files(static_dir=STATIC_DIR):
+    """事前圧縮の対象となる静的ファイルのパスを列挙"""
+    for root, _, files in os.walk(static_dir):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            if name.endswith(PRECOMPRESS_EXTENSIONS) and os.path.getsize(path) >= COMPRESS_MIN_SIZE:
+                yield path
+
+
+def build_static():
+    """フィンガープリント付きアセットを作成し、static/ 内の対象ファイルをすべて事前圧縮"""
+    print("[BUILD] CSS・JavaScriptの縮小とフィンガープリントを開始...")
+    manifest = fingerprint_assets()
+    print(f"[BUILD] マニフェストを作成: {len(manifest)}件")
+
+    print(f"[BUILD] 静的ファイルの事前圧縮を開始（{', '.join(available_encodings())}）...")
+    total_before = 0
+    total_after = 0
+    for path in iter_static_files():
+        size = os.path.getsize(path)
+        sizes = precompress_file(path)
+        total_before += size
+        total_after += min(sizes.values(), default=size)
+        detail = ', '.join(f"{encoding}: {compressed:,}" for encoding, compressed in sizes.items())
+        print(f"[BUILD] {os.path.relpath(path, STATIC_DIR)}: {size:,} バイト → {detail or '圧縮なし'}")
+    print(f"[BUILD] 完了: {total_before:,} バイト → {total_after:,} バイト")
+
+
+if __name__ == "__main__":
+    build_static()
@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""
+学習項目カタログモジュール
+learning_itemsテーブルを起動時に1回だけ読み込み、JSONデコード済み・NULL正規化済みの
+コンパクトなレコード（__slots__）として保持する
+
+読み込んだカタログはバイナリスナップショットとして1回だけ書き出し、各gunicornワーカーは
+それを読み取り専用でmmapする（大きなcontentCreationPromptはmmap上に置いたまま共有）
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows（ローカル開発）ではロックなしで動作
+    fcntl = None
+
+# 進捗管理のレベル（contentCreationPrompt.progressTracking のキー）
+GOAL_LEVELS = ('beginnerGoals', 'intermediateGoals', 'advancedGoals')
+
+# 1レベルあたりのゴール数の上限（進捗のビットマスク: 3レベル × 21 = 63ビットでBIGINTの符号ビットを使わない）
+# カタログ読み込み時に、これを超えるゴールを持つ学習項目が無いことを確認する
+GOALS_PER_LEVEL = 21
+
+# learning_itemsから読み込む列（この順序でタプルを受け取る）
+CATALOG_COLUMNS = (
+    'identifier', 'learning_prompt', 'keywords', 'grade', 'subject',
+    'learning_objective', 'difficulty', 'content_types'
+)
+
+# スナップショットファイル形式
+# ヘッダ: マジック, 形式バージョン, 件数, エラー件数, DBのカタログバージョン, データ部のSHA-256
+# レコード表: 件数分の (データ部内オフセット, head長, body長)
+# データ部: 各レコードの head(一覧用フィールドのJSON) + body(contentCreationPromptのJSON)
+SNAPSHOT_MAGIC = b'STDYCAT\0'
+SNAPSHOT_FORMAT_VERSION = 3
+_SNAPSHOT_HEADER = struct.Struct('<8sIIIQ32s')
+_SNAPSHOT_RECORD = struct.Struct('<QII')
+
+# スナップショットの保存先（全ワーカーで共有）
+SNAPSHOT_PATH = os.environ.get(
+    'CATALOG_SNAPSHOT_PATH',
+    os.path.join(tempfile.gettempdir(), 'study_app_catalog.bin')
+)
+
+
+class LearningItem:
+    """学習項目1件分のレコード（読み込み時にJSONデコード・NULL正規化済み）"""
+    __slots__ = (
+        'identifier', 'learning_prompt', 'keywords', 'grade', 'subject',
+        'learning_objective', 'difficulty', '_content', '_decoded', 'total_goals', 'max_level_goals'
+    )
+
+    def __init__(self, identifier, learning_prompt, keywords, grade, subject,
+                 learning_objective, difficulty, content_creation_prompt, total_goals, max_level_goals=0):
+        self.identifier = identifier
+        self.learning_prompt = learning_prompt
+        self.keywords = keywords
+        self.grade = grade
+        self.subject = subject
+        self.learning_objective = learning_objective
+        self.difficulty = difficulty
+        # 辞書（DBから構築）またはスナップショット上のJSONバイト列（memoryview）
+        self._content = content_creation_prompt
+        self._decoded = None  # スナップショット由来の場合のデコード結果（初回アクセス時に作成）
+        self.total_goals = total_goals
+        # 1レベルあたりの最大ゴール数（DBから構築した場合のみ。GOALS_PER_LEVELとの照合用）
+        self.max_level_goals = max_level_goals
+
+    @property
+    def content_creation_prompt(self):
+        """contentCreationPrompt（スナップショット由来の場合は初回アクセス時に1回だけmmapからデコード）"""
+        content = self._content
+        if not isinstance(content, memoryview):
+            return content
+        decoded = self._decoded
+        if decoded is None:
+            decoded = self._decoded = json.loads(bytes(content))
+        return decoded
+
+    @classmethod
+    def from_row(cls, row):
+        """DBの行タプルからレコードを作成（戻り値: (item, エラー内容またはNone)）"""
+        identifier, learning_prompt, keywords, grade, subject, learning_objective, difficulty, content_types = row
+        error = None
+
+        # keywordsはJSON配列文字列（NULLや不正値は空リスト）
+        try:
+            keyword_list = json.loads(keywords) if keywords else []
+        except (json.JSONDecodeError, TypeError) as e:
+            keyword_list = []
+            error = e
+
+        # content_typesはcontentCreationPromptのJSON文字列
+        try:
+            content_creation_prompt = json.loads(content_types)
+            progress_tracking = content_creation_prompt.get('progressTracking', {})
+            level_goals = [len(progress_tracking.get(level, [])) for level in GOAL_LEVELS]
+            total_goals = sum(level_goals)
+            max_level_goals = max(level_goals)
+        except (json.JSONDecodeError, TypeError, AttributeError) as e:
+            content_creation_prompt = None
+            total_goals = 0  # パース失敗時は0
+            max_level_goals = 0
+            error = e
+
+        item = cls(
+            identifier=identifier,
+            learning_prompt=learning_prompt,
+            keywords=keyword_list,
+            grade=grade if grade is not None else 0,  # gradeのNULLは0に変換
+            subject=subject,
+            learning_objective=learning_objective,
+            difficulty=difficulty,
+            content_creation_prompt=content_creation_prompt,
+            total_goals=total_goals,
+            max_level_goals=max_level_goals
+        )
+        return item, error
+
+    def encode(self):
+        """スナップショット用に (head, body) のバイト列へ変換"""
+        head = json.dumps([
+            self.identifier, self.learning_prompt, self.keywords, self.grade, self.subject,
+            self.learning_objective, self.difficulty, self.total_goals
+        ], ensure_ascii=False).encode('utf-8')
+        if isinstance(self._content, memoryview):
+            body = bytes(self._content)
+        else:
+            body = json.dumps(self._content, ensure_ascii=False).encode('utf-8')
+        return head, body
+
+    @classmethod
+    def decode(cls, head, body):
+        """スナップショットの head と body（memoryview）からレコードを復元"""
+        identifier, learning_prompt, keywords, grade, subject, learning_objective, difficulty, total_goals = json.loads(bytes(head))
+        return cls(
+            identifier=identifier,
+            learning_prompt=learning_prompt,
+            keywords=keywords,
+            grade=grade,
+            subject=subject,
+            learning_objective=learning_objective,
+            difficulty=difficulty,
+            content_creation_prompt=None if body == b'null' else body,
+            total_goals=total_goals
+        )
+
+    def to_summary(self):
+        """一覧表示・統計用の辞書を作成"""
+        return {
+            'identifier': self.identifier,
+            'learning_prompt': self.learning_prompt,
+            'keywords': self.keywords,
+            'grade': self.grade,
+            'subject': self.subject,
+            'learning_objective': self.learning_objective,
+            'difficulty': self.difficulty,
+            'total_goals': self.total_goals
+        }
+
+    def to_prompt_context(self):
+        """AIプロンプトに埋め込む学習内容・学習ゴールの文章を作成"""
+        progress_tracking = (self.content_creation_prompt or {}).get('progressTracking', {})
+        goals = [', '.join(progress_tracking.get(level, [])) for level in GOAL_LEVELS]
+        return (
+            "【現在の学習内容】\n"
+            f"• 教科: {self.subject or '未設定'}\n"
+            f"• 学年: {self.grade}年生\n"
+            f"• 学習目標: {self.learning_objective or '未設定'}\n"
+            f"• キーワード: {', '.join(self.keywords)}\n"
+            "\n"
+            "【学習ゴール】\n"
+            f"初心者レベル: {goals[0]}\n"
+            f"中級者レベル: {goals[1]}\n"
+            f"上級者レベル: {goals[2]}"
+        )
+
+    def to_content(self):
+        """コンテンツ詳細（/api/content, content.html）用の辞書を作成"""
+        return {
+            'identifier': self.identifier,
+            'learningPromptData': {
+                'learningPrompt': self.learning_prompt,
+                'keywords': self.keywords,
+                'grade': self.grade,
+                'subject': self.subject,
+                'learningObjective': self.learning_objective,
+                'difficulty': self.difficulty
+            },
+            'contentCreationPrompt': self.content_creation_prompt
+        }
+
+
+class Catalog:
+    """identifier昇順に並んだ学習項目の読み取り専用カタログ"""
+
+    def __init__(self, items, error_count=0, version=None, source_version=None):
+        self.items = items
+        # 読み込み元のDBのカタログバージョン（catalog_version.version）
+        self.source_version = source_version
+        # DBのカタログバージョンと照合せずに使っているスナップショットか（DBに接続できなかった場合）
+        self.stale = False
+        self.identifiers = [item.identifier for item in items]
+        # identifier → レコードのハッシュインデックス（O(1)検索）
+        self.index = {item.identifier: item for item in items}
+        self.error_count = error_count
+
+        # 教科の順序（identifier順で最初に現れた順 = 学習指導要領の順序）
+        self.subjects = []
+        self.items_by_subject = {}
+        for item in items:
+            if item.subject is None:
+                continue
+            if item.subject not in self.items_by_subject:
+                self.subjects.append(item.subject)
+                self.items_by_subject[item.subject] = []
+            self.items_by_subject[item.subject].append(item)
+
+        self.stats = {
+            'totalIdentifiers': len(items),
+            'totalGoals': sum(item.total_goals for item in items),
+            'errorCount': error_count
+        }
+        self._version = version
+        self._summary_by_subject = None
+        self._prompt_contexts = {}  # identifier → AIプロンプト用の学習内容の文章
+
+    @property
+    def version(self):
+        """カタログのバージョン（内容のSHA-256から算出、内容が同じなら全ワーカーで同じ値）"""
+        if self._version is None:
+            digest = hashlib.sha256()
+            for item in self.items:
+                head, body = item.encode()
+                digest.update(head)
+                digest.update(body)
+            self._version = digest.hexdigest()[:16]
+        return self._version
+
+    @classmethod
+    def from_rows(cls, rows, source_version=None):
+        """DBの行タプル列からカタログを構築"""
+        items = []
+        error_count = 0
+        for row in rows:
+            item, error = LearningItem.from_row(row)
+            if error is not None:
+                error_count += 1
+                if error_count <= 3:  # 最初の3件のみログ出力
+                    print(f"[CATALOG] データ解析エラー (ID: {item.identifier}): {error}")
+            items.append(item)
+
+        # 進捗はゴールをビット位置で保存するため、上限を超えるゴールがあると一部の進捗を保存できない
+        # （保存時に400で拒否されるのを見逃さないよう、カタログの読み込み自体を失敗させる）
+        oversized = [item for item in items if item.max_level_goals > GOALS_PER_LEVEL]
+        if oversized:
+            examples = ', '.join(f"{item.identifier}({item.max_level_goals})" for item in oversized[:5])
+            print(f"[CATALOG] ERROR: 1レベルあたりのゴール数が上限（{GOALS_PER_LEVEL}）を超える学習項目が{len(oversized)}件あります: {examples}")
+            raise ValueError(f"{len(oversized)} learning items exceed GOALS_PER_LEVEL ({GOALS_PER_LEVEL}): {examples}")
+
+        # Python側の順序でソート（DBの照合順序に依存しない）
+        items.sort(key=lambda item: item.identifier)
+        return cls(items, error_count, source_version=source_version)
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, identifier):
+        """identifierからレコードを取得（見つからない場合はNone）"""
+        return self.index.get(identifier)
+
+    def summary_by_subject(self):
+        """教科ごとの一覧用辞書（初回のみ作成し、以降は同じオブジェクトを返す）"""
+        if self._summary_by_subject is None:
+            self._summary_by_subject = {
+                subject: [item.to_summary() for item in self.items_by_subject[subject]]
+                for subject in self.subjects
+            }
+        return self._summary_by_subject
+
+    def prompt_context(self, identifier):
+        """AIプロンプト用の学習内容の文章（項目ごとに初回のみ作成、見つからない場合はNone）
+
+        カタログはバージョンが変わると丸ごと差し替わるため、作成済みの文章も同時に破棄される
+        """
+        context = self._prompt_contexts.get(identifier)
+        if context is None:
+            item = self.index.get(identifier)
+            if item is None:
+                return None
+            context = self._prompt_contexts[identifier] = item.to_prompt_context()
+        return context
+
+    @classmethod
+    def from_snapshot(cls, path):
+        """スナップショットを読み取り専用でmmapしてカタログを構築（不正な形式・途中までしか書かれていない場合はValueError）"""
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, format_version, count, error_count, source_version, digest = _SNAPSHOT_HEADER.unpack_from(buffer, 0)
+        if magic != SNAPSHOT_MAGIC or format_version != SNAPSHOT_FORMAT_VERSION:
+            buffer.close()
+            raise ValueError(f"Unsupported catalog snapshot: {path}")
+
+        data_start = _SNAPSHOT_HEADER.size + _SNAPSHOT_RECORD.size * count
+        records = [_SNAPSHOT_RECORD.unpack_from(buffer, _SNAPSHOT_HEADER.size + _SNAPSHOT_RECORD.size * i)
+                   for i in range(count)]
+        # データ部の長さとSHA-256がヘッダと一致しない場合は使わない（DBから構築し直す）
+        data_len = sum(head_len + body_len for _, head_len, body_len in records)
+        view = memoryview(buffer)
+        if data_start + data_len != len(buffer) or hashlib.sha256(view[data_start:]).digest() != digest:
+            view.release()
+            buffer.close()
+            raise ValueError(f"Corrupted catalog snapshot (size or digest mismatch): {path}")
+
+        items = []
+        for offset, head_len, body_len in records:
+            head_start = data_start + offset
+            body_start = head_start + head_len
+            items.append(LearningItem.decode(
+                view[head_start:body_start],
+                view[body_start:body_start + body_len]
+            ))
+        return cls(items, error_count, version=digest.hex()[:16], source_version=source_version)
+
+    def write_snapshot(self, path):
+        """スナップショットを書き出し（一時ファイルに書いてからアトミックに置き換え）"""
+        records = []
+        chunks = []
+        digest = hashlib.sha256()
+        offset = 0
+        for item in self.items:
+            head, body = item.encode()
+            records.append(_SNAPSHOT_RECORD.pack(offset, len(head), len(body)))
+            chunks.append(head)
+            chunks.append(body)
+            digest.update(head)
+            digest.update(body)
+            offset += len(head) + len(body)
+
+        header = _SNAPSHOT_HEADER.pack(
+            SNAPSHOT_MAGIC, SNAPSHOT_FORMAT_VERSION, len(self.items), self.error_count,
+            self.source_version or 0, digest.digest()
+        )
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.catalog-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(header)
+                f.writelines(records)
+                f.writelines(chunks)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._version = digest.hexdigest()[:16]
+        return self._version
+
+
+def load_catalog(fetch_rows, path=SNAPSHOT_PATH, source_version=None):
+    """スナップショットからカタログを読み込む。無い・古い場合はDBから構築して書き出す
+
+    fetch_rows: (DBのカタログバージョン, CATALOG_COLUMNS順の行タプル列) を返す関数
+    source_version: 必要なDBのカタログバージョン（Noneなら既存のスナップショットをそのまま使う）
+    """
+    catalog = _try_load_snapshot(path, source_version)
+    if catalog is not None:
+        return catalog
+
+    # 複数ワーカーが同時に起動・更新を検知してもDB読み込み・書き出しは1回だけにする
+    with open(path + '.lock', 'a') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            catalog = _try_load_snapshot(path, source_version)
+            if catalog is not None:
+                return catalog
+
+            fetched_version, rows = fetch_rows()
+            catalog = Catalog.from_rows(rows, source_version=fetched_version)
+            try:
+                version = catalog.write_snapshot(path)
+                print(f"[CATALOG] SUCCESS: Snapshot written ({len(catalog)} items, "
+                      f"version {version}, source version {fetched_version})")
+            except OSError as e:
+                # 書き出せない環境ではワーカー単位のメモリ上カタログで動作
+                print(f"[CATALOG] WARNING: Failed to write snapshot: {e}")
+                return catalog
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # 書き出したスナップショットをmmapして、他のワーカーと同じ物理ページを使う
+    mapped = _try_load_snapshot(path, fetched_version)
+    return mapped if mapped is not None else catalog
+
+
+def _try_load_snapshot(path, source_version=None):
+    """スナップショットがあれば読み込む（無い・壊れている・バージョンが違う場合はNone）"""
+    if not os.path.exists(path):
+        return None
+    try:
+        catalog = Catalog.from_snapshot(path)
+    except (OSError, ValueError, struct.error) as e:
+        print(f"[CATALOG] WARNING: Ignoring unreadable snapshot {path}: {e}")
+        return None
+    if source_version is not None and catalog.source_version != source_version:
+        return None
+    if source_version is None:
+        # DBのカタログバージョンと照合できないため、DBに再接続できるまで古い可能性があるものとして扱う
+        catalog.stale = True
+        age_hours = (time.time() - os.path.getmtime(path)) / 3600
+        print(f"[CATALOG] WARNING: Using unverified snapshot (created {age_hours:.1f}h ago, "
+              f"source version {catalog.source_version}); it may be stale until the database is reachable")
+    print(f"[CATALOG] INFO: Snapshot mapped ({len(catalog)} items, "
+          f"version {catalog.version}, source version {catalog.source_version})")
+    return catalog
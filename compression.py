@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+レスポンス圧縮モジュール
+HTML・JSON等の動的レスポンスは、一定サイズ以上ならAccept-Encodingに応じてbrotli（利用可能な場合）またはgzipで圧縮する。
+静的ファイルは build_static.py で事前に作成した .br / .gz をそのまま返す（リクエストごとに圧縮しない）
+"""
+
+import gzip
+import mimetypes
+import os
+
+from flask import current_app, request, send_from_directory
+from werkzeug.security import safe_join
+
+# brotliはオプション（未インストールの場合はgzipのみ）
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_ENABLED = os.environ.get('COMPRESS_ENABLED', '1') == '1'
+# これより小さいレスポンスは圧縮しない（バイト）
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', '500'))
+# 動的レスポンスの圧縮レベル（応答時間を優先して中程度。静的ファイルは事前に最大レベルで圧縮）
+COMPRESS_GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', '6'))
+COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', '4'))
+
+COMPRESSIBLE_MIMETYPES = {
+    'text/html', 'text/css', 'text/plain', 'text/javascript',
+    'application/javascript', 'application/json', 'image/svg+xml'
+}
+
+# 事前圧縮ファイルの拡張子（優先順）
+PRECOMPRESSED_SUFFIXES = (('br', '.br'), ('gzip', '.gz'))
+
+
+def available_encodings():
+    """サーバーが対応している圧縮形式（優先順）"""
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def negotiate_encoding(candidates):
+    """Accept-Encodingから使用する圧縮形式を選ぶ（圧縮しない場合はNone）"""
+    for encoding in candidates:
+        # q=0 で明示的に拒否された形式は使わない
+        if request.accept_encodings[encoding] > 0:
+            return encoding
+    return None
+
+
+def compress(data, encoding, gzip_level=COMPRESS_GZIP_LEVEL, brotli_quality=COMPRESS_BROTLI_QUALITY):
+    """データを指定形式で圧縮"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=brotli_quality)
+    # mtime=0 で同じ内容なら同じ圧縮結果にする
+    return gzip.compress(data, compresslevel=gzip_level, mtime=0)
+
+
+def compress_response(response):
+    """after_request: 圧縮可能な動的レスポンスを圧縮"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    # 圧縮するかどうかがAccept-Encodingで変わることをキャッシュに伝える
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding(available_encodings())
+    if encoding is None:
+        return response
+    response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    # 圧縮後のバイト列は元と異なるため、強いETagは弱いETagにする（If-None-Matchは弱い比較で判定）
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def _is_fresh(source, variant):
+    """事前圧縮ファイルが存在し、元ファイル以降に作成されているか"""
+    return os.path.isfile(variant) and os.path.getmtime(variant) >= os.path.getmtime(source)
+
+
+def serve_static(filename):
+    """静的ファイルを返す（元ファイルより新しい事前圧縮ファイルがあれば、Accept-Encodingに応じてそちらを返す）"""
+    static_folder = current_app.static_folder
+    max_age = current_app.get_send_file_max_age(filename)
+    source = safe_join(static_folder, filename)
+    if source is not None and os.path.isfile(source):
+        variants = {encoding: suffix for encoding, suffix in PRECOMPRESSED_SUFFIXES if _is_fresh(source, source + suffix)}
+        if variants:
+            encoding = negotiate_encoding(list(variants))
+            if encoding is None:
+                response = send_from_directory(static_folder, filename, max_age=max_age)
+            else:
+                mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+                response = send_from_directory(static_folder, filename + variants[encoding],
+                                               mimetype=mimetype, max_age=max_age)
+                response.headers['Content-Encoding'] = encoding
+            response.vary.add('Accept-Encoding')
+            return response
+    return send_from_directory(static_folder, filename, max_age=max_age)
+
+
+def init_compression(app):
+    """Flaskアプリに圧縮を設定（COMPRESS_ENABLED=0で無効）"""
+    if not COMPRESS_ENABLED:
+        return
+    app.after_request(compress_response)
+    # 組み込みの静的ファイル配信を、事前圧縮ファイルに対応したものに置き換え
+    app.view_functions['static'] = serve_static
+    print(f"[STARTUP] レスポンス圧縮を有効化: {', '.join(available_encodings())}（{COMPRESS_MIN_SIZE}バイト以上）")
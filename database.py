@@ -4,9 +4,12 @@ psycopg (v3) 対応データベース管理モジュール
 PostgreSQL対応 - 最新のpsycopg v3を使用
 """
 
-import os
-import pandas as pd
+import csv
+import hashlib
 import json
+import os
+import sys
+import threading
 from dotenv import load_dotenv
 
 # psycopg v3のみを使用
@@ -25,12 +28,28 @@ except ImportError:
 # 環境変数読み込み
 load_dotenv()
 
-# グローバル接続プール（アプリケーション起動時に1回だけ作成）
+# グローバル接続プール（最初にDBを使うときに1回だけ作成）
 _global_connection_pool = None
 _global_db_type = None
+_global_pool_initialized = False
+_global_pool_lock = threading.Lock()
 
 def initialize_global_connection_pool():
-    """グローバル接続プールの初期化（1回のみ実行）"""
+    """グローバル接続プールの初期化（1回のみ実行）
+
+    初期化済みフラグはプールとDBタイプを設定し終えてから立てる
+    （作成中に他のスレッドがフラグだけを見て未設定のプールを使わないようにする）
+    """
+    global _global_pool_initialized
+    with _global_pool_lock:
+        if _global_pool_initialized:
+            return
+        try:
+            _initialize_global_connection_pool()
+        finally:
+            _global_pool_initialized = True
+
+def _initialize_global_connection_pool():
     global _global_connection_pool, _global_db_type
     
     if _global_connection_pool is not None:
@@ -63,25 +82,28 @@ def initialize_global_connection_pool():
             _global_db_type = None
 
 class DatabaseManager:
-    """グローバル接続プールを使用したデータベース管理クラス"""
+    """グローバル接続プールを使用したデータベース管理クラス（プールは初回利用時に作成）"""
     
-    def __init__(self):
-        # グローバル接続プールがまだ初期化されていない場合は初期化
-        if _global_connection_pool is None:
+    def _ensure_pool(self):
+        """グローバル接続プールがまだ初期化されていない場合は初期化（作成中の場合はロックで完了を待つ）"""
+        if not _global_pool_initialized:
             initialize_global_connection_pool()
     
     @property
     def connection_pool(self):
         """グローバル接続プールへのアクセス"""
+        self._ensure_pool()
         return _global_connection_pool
     
     @property
     def db_type(self):
         """データベースタイプへのアクセス"""
+        self._ensure_pool()
         return _global_db_type
     
     def get_connection(self):
         """データベース接続を取得"""
+        self._ensure_pool()
         if _global_db_type == 'postgresql':
             if _global_connection_pool:
                 # ConnectionPoolから接続を取得
@@ -113,10 +135,7 @@ class DatabaseManager:
                 cur.execute(query, params)
                 return cur.fetchone()
 
-# グローバル接続プールの初期化
-initialize_global_connection_pool()
-
-# グローバルインスタンス
+# グローバルインスタンス（import時には接続しない）
 db_manager = DatabaseManager()
 
 def initialize_database():
@@ -168,17 +187,42 @@ def _create_tables_psycopg3(cur):
         )
     """)
     
-    # progressテーブル
+    # progress_bitsテーブル（ユーザー・学習項目ごとに1行、ゴールの進捗はビットマスク。形式はprogress.pyを参照）
     cur.execute("""
-        CREATE TABLE IF NOT EXISTS progress (
-            id SERIAL PRIMARY KEY,
+        CREATE TABLE IF NOT EXISTS progress_bits (
             user_id INTEGER NOT NULL,
             item_identifier VARCHAR(50) NOT NULL,
-            level VARCHAR(20) NOT NULL,
-            goal_index INTEGER NOT NULL,
-            completed BOOLEAN DEFAULT FALSE,
+            done BIGINT NOT NULL DEFAULT 0,
+            touched BIGINT NOT NULL DEFAULT 0,
+            version BIGINT NOT NULL DEFAULT 0,
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(user_id, item_identifier, level, goal_index)
+            PRIMARY KEY (user_id, item_identifier)
+        )
+    """)
+    # 集計の差分計算用: 直前の書き込みで置き換えられる前のdone
+    cur.execute("ALTER TABLE progress_bits ADD COLUMN IF NOT EXISTS prev_done BIGINT NOT NULL DEFAULT 0")
+    # 旧形式（1ゴール1行）のprogressテーブルが残っていれば移行
+    from progress import migrate_legacy_progress
+    migrate_legacy_progress(cur)
+    
+    # progress_versionsテーブル（ユーザーの進捗が変わるたびにversionを加算）
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS progress_versions (
+            user_id INTEGER PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 0
+        )
+    """)
+    # progress_summaryを集計した時のカタログバージョン（NULLまたは現在と異なる場合は読み込み時に再集計）
+    cur.execute("ALTER TABLE progress_versions ADD COLUMN IF NOT EXISTS summary_catalog_version VARCHAR(16)")
+    
+    # progress_summaryテーブル（ユーザー・教科ごとの完了ゴール数と達成項目数、進捗の書き込みと同じトランザクションで加減算）
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS progress_summary (
+            user_id INTEGER NOT NULL,
+            subject VARCHAR(50) NOT NULL,
+            completed_goals INTEGER NOT NULL DEFAULT 0,
+            achieved_items INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, subject)
         )
     """)
     
@@ -197,11 +241,113 @@ def _create_tables_psycopg3(cur):
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     """)
+    # 差分再読み込み用: TSV行内容のハッシュ
+    cur.execute("ALTER TABLE learning_items ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)")
+    
+    # catalog_versionテーブル（learning_itemsが変わるたびにversionを加算する1行だけのテーブル）
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS catalog_version (
+            id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+            version BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("INSERT INTO catalog_version (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING")
+    
+    # rate_limit_bucketsテーブル（RATE_LIMIT_BACKEND=postgres の場合のワーカー間共有のトークンバケット）
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+            key VARCHAR(200) PRIMARY KEY,
+            tokens DOUBLE PRECISION NOT NULL,
+            allowed BOOLEAN NOT NULL DEFAULT TRUE,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """)
 
 # psycopg v3のみを使用するため、psycopg2関数は削除
 
+# learning_itemsへのCOPY対象列（_iter_learning_rowsが返すタプルの順序）
+LEARNING_ITEM_COLUMNS = (
+    'identifier', 'learning_prompt', 'keywords', 'grade', 'subject',
+    'learning_objective', 'difficulty', 'content_types', 'content_hash'
+)
+
+def get_catalog_version(cur):
+    """現在のカタログバージョンを取得"""
+    cur.execute("SELECT version FROM catalog_version WHERE id = 1")
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+def bump_catalog_version(cur):
+    """カタログバージョンを1つ進める（learning_itemsを変更したトランザクション内で呼ぶ）"""
+    cur.execute("""
+        INSERT INTO catalog_version (id, version, updated_at) VALUES (1, 1, CURRENT_TIMESTAMP)
+        ON CONFLICT (id) DO UPDATE SET version = catalog_version.version + 1, updated_at = CURRENT_TIMESTAMP
+        RETURNING version
+    """)
+    return cur.fetchone()[0]
+
+def _content_hash(learning_prompt, content_types):
+    """TSV行の内容ハッシュ（差分再読み込みで変更の有無を判定）"""
+    source = f"{learning_prompt or ''}\x1f{content_types or ''}"
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+def _iter_learning_rows(tsv_path, errors):
+    """TSVファイルを1行ずつ読み、learning_itemsの行タプルを返すジェネレータ
+
+    解析できない行はerrorsに (行番号, identifier, エラー内容) を追加する
+    （JSON解析エラーの行はデフォルト値で取り込み、identifierの欠落・重複行はスキップ）
+    """
+    # learningPromptData等の長いJSON列に対応
+    csv.field_size_limit(sys.maxsize)
+    seen = set()
+    
+    with open(tsv_path, newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f, delimiter='\t')
+        for line_number, row in enumerate(reader, start=2):
+            identifier = (row.get('identifier') or '').strip()
+            if not identifier:
+                errors.append((line_number, None, 'identifierがありません'))
+                continue
+            if identifier in seen:
+                errors.append((line_number, identifier, 'identifierが重複しています'))
+                continue
+            seen.add(identifier)
+            
+            learning_prompt = row.get('learningPromptData')
+            content_types = row.get('contentCreationPrompt')
+            content_hash = _content_hash(learning_prompt, content_types)
+            try:
+                # learningPromptDataのJSONからsubject等を抽出
+                learning_data = json.loads(learning_prompt)
+                keywords = learning_data.get('keywords')
+                yield (
+                    identifier,
+                    learning_prompt,
+                    json.dumps(keywords, ensure_ascii=False) if keywords else None,
+                    learning_data.get('grade'),
+                    learning_data.get('subject'),  # JSONからsubjectを抽出
+                    learning_data.get('learningObjective'),
+                    learning_data.get('difficulty'),
+                    content_types,
+                    content_hash
+                )
+            except (json.JSONDecodeError, TypeError, AttributeError) as e:
+                errors.append((line_number, identifier, f'データ解析エラー: {e}'))
+                # エラー時はデフォルト値で挿入
+                yield (identifier, learning_prompt, None, None, '学習', None, None, content_types, content_hash)
+
+def _copy_learning_rows(cur, rows, table='learning_items'):
+    """行タプルをCOPY ... FROM STDINでテーブルに流し込み、件数を返す"""
+    count = 0
+    with cur.copy(f"COPY {table} ({', '.join(LEARNING_ITEM_COLUMNS)}) FROM STDIN") as copy:
+        for row in rows:
+            copy.write_row(row)
+            count += 1
+    return count
+
 def _load_learning_data():
-    """TSVファイルからデータを読み込み"""
+    """TSVファイルからデータを読み込み（ストリーミング解析 + COPYで1トランザクション）"""
     try:
         tsv_path = os.path.join(os.path.dirname(__file__), 'learning_data.tsv')
         if not os.path.exists(tsv_path):
@@ -218,51 +364,88 @@ def _load_learning_data():
             print(f"[DB] INFO: Learning items already loaded ({count} items)")
             return
         
-        # TSVファイルを読み込み
-        df = pd.read_csv(tsv_path, sep='\t', encoding='utf-8')
-        
-        # データベースに挿入
+        # TSVを1行ずつ解析しながらデータベースにCOPY
+        errors = []
         with db_manager.get_connection() as conn:
             with conn.cursor() as cur:
-                for _, row in df.iterrows():
-                    try:
-                        # learningPromptDataのJSONからsubject等を抽出
-                        learning_data = json.loads(row['learningPromptData'])
-                        
-                        cur.execute("""
-                            INSERT INTO learning_items 
-                            (identifier, learning_prompt, keywords, grade, subject, learning_objective, difficulty, content_types)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                        """, (
-                            row['identifier'],
-                            row['learningPromptData'],
-                            json.dumps(learning_data.get('keywords', [])) if learning_data.get('keywords') else None,
-                            learning_data.get('grade'),
-                            learning_data.get('subject'),  # JSONからsubjectを抽出
-                            learning_data.get('learningObjective'),
-                            learning_data.get('difficulty'),
-                            row['contentCreationPrompt']
-                        ))
-                    except (json.JSONDecodeError, KeyError) as e:
-                        print(f"[DB] WARNING: データ解析エラー (ID: {row.get('identifier', 'unknown')}): {e}")
-                        # エラー時はデフォルト値で挿入
-                        cur.execute("""
-                            INSERT INTO learning_items 
-                            (identifier, learning_prompt, keywords, grade, subject, learning_objective, difficulty, content_types)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                        """, (
-                            row['identifier'],
-                            row['learningPromptData'],
-                            None, None, '学習', None, None,
-                            row['contentCreationPrompt']
-                        ))
-                        continue
-                
-                conn.commit()
+                loaded = _copy_learning_rows(cur, _iter_learning_rows(tsv_path, errors))
+                bump_catalog_version(cur)
+            conn.commit()
         
-        print(f"[DB] SUCCESS: Loaded {len(df)} learning items")
+        _report_row_errors(tsv_path, errors)
+        print(f"[DB] SUCCESS: Loaded {loaded} learning items ({len(errors)} row errors)")
         
     except Exception as e:
         print(f"[DB] ERROR: Failed to load learning data: {e}")
         import traceback
-        traceback.print_exc()
\ No newline at end of file
+        traceback.print_exc()
+
+def sync_learning_data():
+    """TSVファイルとlearning_itemsの差分だけを反映（内容ハッシュが変わった行のみUPSERT）
+
+    全体を1トランザクションで行うため、実行中もlearning_itemsが空になることはない。
+    変更があった場合はカタログバージョンを進め、各ワーカーが新しいカタログに差し替える。
+    戻り値: {'upserted', 'deleted', 'errors', 'version'}
+    """
+    tsv_path = os.path.join(os.path.dirname(__file__), 'learning_data.tsv')
+    if not os.path.exists(tsv_path):
+        raise FileNotFoundError(f"learning_data.tsv not found: {tsv_path}")
+    
+    errors = []
+    with db_manager.get_connection() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    CREATE TEMP TABLE learning_items_incoming (
+                        identifier VARCHAR(50) PRIMARY KEY,
+                        learning_prompt TEXT,
+                        keywords TEXT,
+                        grade INTEGER,
+                        subject VARCHAR(50),
+                        learning_objective TEXT,
+                        difficulty VARCHAR(20),
+                        content_types TEXT,
+                        content_hash VARCHAR(64)
+                    ) ON COMMIT DROP
+                """)
+                incoming = _copy_learning_rows(cur, _iter_learning_rows(tsv_path, errors), table='learning_items_incoming')
+                if incoming == 0:
+                    # 空のTSVで全件削除してしまわないように中止
+                    raise ValueError("learning_data.tsv has no valid rows")
+                
+                columns = ', '.join(LEARNING_ITEM_COLUMNS)
+                updates = ', '.join(f"{column} = EXCLUDED.{column}" for column in LEARNING_ITEM_COLUMNS[1:])
+                cur.execute(f"""
+                    INSERT INTO learning_items ({columns})
+                    SELECT {columns} FROM learning_items_incoming
+                    ON CONFLICT (identifier) DO UPDATE SET {updates}
+                    WHERE learning_items.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+                """)
+                upserted = cur.rowcount
+                
+                cur.execute("""
+                    DELETE FROM learning_items li
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM learning_items_incoming i WHERE i.identifier = li.identifier
+                    )
+                """)
+                deleted = cur.rowcount
+                
+                if upserted or deleted:
+                    version = bump_catalog_version(cur)
+                else:
+                    version = get_catalog_version(cur)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    
+    _report_row_errors(tsv_path, errors)
+    print(f"[DB] SUCCESS: Synced learning items ({upserted} upserted, {deleted} deleted, "
+          f"{len(errors)} row errors, catalog version {version})")
+    return {'upserted': upserted, 'deleted': deleted, 'errors': len(errors), 'version': version}
+
+def _report_row_errors(tsv_path, errors):
+    """行単位のエラーを最後にまとめて報告"""
+    for line_number, identifier, message in errors:
+        print(f"[DB] WARNING: {tsv_path}:{line_number} (ID: {identifier or 'unknown'}): {message}")
@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+"""
+データベース初期化スクリプト
+テーブル作成と学習データの初回読み込みを行う（デプロイ時に1回だけ実行）
+リクエストを処理するワーカーでは起動時にスキーマ作成を行わない
+"""
+
+import os
+import sys
+from dotenv import load_dotenv
+
+# 環境変数読み込み
+load_dotenv()
+
+# プロジェクトのパスを追加
+sys.path.append(os.path.dirname(__file__))
+
+from database import initialize_database
+
+if __name__ == "__main__":
+    print("[INIT] データベースの初期化を開始...")
+    if not initialize_database():
+        print("[INIT] ERROR: データベースの初期化に失敗しました")
+        sys.exit(1)
+    print("[INIT] データベースの初期化が完了しました")
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+定期メンテナンスモジュール
+プレミアム期限切れの解除と月次の利用回数リセットを、バックグラウンドで一括UPDATEする
+（複数ワーカーのうち1つだけが実行するようにアドバイザリロックで排他）
+"""
+
+import threading
+import time
+from datetime import datetime
+
+from auth import invalidate_user_cache
+from database import db_manager
+from rate_limit import RATE_LIMIT_BACKEND
+
+# pg_try_advisory_xact_lock のキー（このアプリのメンテナンス処理専用）
+MAINTENANCE_LOCK_ID = 73110901
+
+
+def expire_premiums(cur, now):
+    """期限切れのプレミアムを一括解除し、対象のユーザーIDを返す"""
+    cur.execute("""
+        UPDATE users SET is_premium = FALSE, premium_expires_at = NULL
+        WHERE is_premium = TRUE AND premium_expires_at IS NOT NULL AND premium_expires_at < %s
+        RETURNING id
+    """, (now,))
+    return [row[0] for row in cur.fetchall()]
+
+
+def reset_monthly_usage(cur, today):
+    """前月以前にリセットされたユーザーの利用回数を一括で0に戻し、対象のユーザーIDを返す"""
+    month_start = today.replace(day=1)
+    cur.execute("""
+        UPDATE users SET free_usage_count = 0, last_reset_date = %s
+        WHERE COALESCE(last_reset_date, created_at::date) < %s
+        RETURNING id
+    """, (today, month_start))
+    return [row[0] for row in cur.fetchall()]
+
+
+def purge_rate_limit_buckets(cur):
+    """1日以上使われていないレート制限のバケットを削除し、件数を返す"""
+    cur.execute("DELETE FROM rate_limit_buckets WHERE updated_at < now() - INTERVAL '1 day'")
+    return cur.rowcount
+
+
+def run_maintenance():
+    """メンテナンスを1回実行（他のワーカーが実行中ならスキップしてNoneを返す）"""
+    now = datetime.now()
+    with db_manager.get_connection() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_try_advisory_xact_lock(%s)", (MAINTENANCE_LOCK_ID,))
+                if not cur.fetchone()[0]:
+                    conn.rollback()
+                    return None
+
+                expired = expire_premiums(cur, now)
+                reset = reset_monthly_usage(cur, now.date())
+                # バケットをDBに保存していない場合（既定のメモリ）は削除する行が無い
+                purged = purge_rate_limit_buckets(cur) if RATE_LIMIT_BACKEND == 'postgres' else 0
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    for user_id in set(expired) | set(reset):
+        invalidate_user_cache(user_id)
+    if expired or reset:
+        print(f"[MAINT] プレミアム期限切れ解除: {len(expired)}件, 月次利用回数リセット: {len(reset)}件")
+    return {'expired': len(expired), 'reset': len(reset), 'purgedRateLimitBuckets': purged}
+
+
+def start_maintenance_scheduler(interval, initial_delay=10):
+    """メンテナンスを定期実行するバックグラウンドスレッドを開始"""
+    def run():
+        time.sleep(initial_delay)
+        while True:
+            try:
+                run_maintenance()
+            except Exception as e:
+                print(f"[MAINT] ERROR: メンテナンス実行エラー: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name='maintenance', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+学習進捗のデータアクセスモジュール
+進捗は (ユーザー, 学習項目) ごとに1行のビットマスクで保存し、ビット演算のUPSERTで更新する
+（ビット位置 = レベルの順番 × GOALS_PER_LEVEL + ゴール番号）。
+API には従来どおり (item_identifier, level, goal_index, completed) の行として返す
+
+進捗の書き込みごとにユーザーの進捗バージョンを加算し、各行にも書き込み時のバージョンを記録する
+（クライアントは前回同期したバージョン以降に変わった行だけを取得できる）
+
+ホーム画面の統計用に、ユーザー・教科ごとの完了ゴール数と達成項目数をprogress_summaryに保持し、
+進捗の書き込みと同じトランザクションで変化した分だけ加減算する
+"""
+
+from catalog import GOAL_LEVELS, GOALS_PER_LEVEL
+from database import db_manager
+
+# 進捗バージョンの加算と全学習項目のUPSERTを1つの文で行う（配列をunnestして複数ユーザー・複数行を一括で書き込む）
+# done: 完了したゴールのビット、touched: 記録済みのゴールのビット（未完了に戻したゴールも含む）
+# 書き込むビット（EXCLUDED.touched）だけを置き換え、他のゴールの状態は保持する
+# prev_doneに置き換え前のdoneを残し、集計の差分計算に使う（新規行は0）
+# 行ロックの順序を全トランザクションで揃えてデッドロックを防ぐため、配列の順序（ユーザーID・学習項目の昇順）で書き込む
+_UPSERT_SQL = """
+    WITH bumped AS (
+        INSERT INTO progress_versions (user_id, version)
+        SELECT u.user_id, 1
+        FROM unnest(%(user_ids)s::integer[]) WITH ORDINALITY AS u(user_id, ord)
+        ORDER BY u.ord
+        ON CONFLICT (user_id) DO UPDATE SET version = progress_versions.version + 1
+        RETURNING user_id, version
+    ), written AS (
+        INSERT INTO progress_bits (user_id, item_identifier, done, touched, version, updated_at)
+        SELECT u.user_id, u.item_identifier, u.done, u.touched, bumped.version, %(updated_at)s
+        FROM unnest(%(row_user_ids)s::integer[], %(items)s::varchar[], %(done)s::bigint[], %(touched)s::bigint[])
+            WITH ORDINALITY AS u(user_id, item_identifier, done, touched, ord)
+        JOIN bumped USING (user_id)
+        ORDER BY u.ord
+        ON CONFLICT (user_id, item_identifier) DO UPDATE SET
+            prev_done = progress_bits.done,
+            done = (progress_bits.done & ~EXCLUDED.touched) | EXCLUDED.done,
+            touched = progress_bits.touched | EXCLUDED.touched,
+            version = EXCLUDED.version,
+            updated_at = EXCLUDED.updated_at
+        RETURNING user_id, item_identifier, prev_done, done
+    )
+    SELECT written.user_id, bumped.version, written.item_identifier, written.prev_done, written.done
+    FROM written JOIN bumped USING (user_id)
+"""
+
+# 教科ごとの集計に差分を加算（同じカタログで集計済みのユーザーのみ。それ以外は読み込み時に再集計される）
+_SUMMARY_DELTA_SQL = """
+    INSERT INTO progress_summary (user_id, subject, completed_goals, achieved_items)
+    SELECT d.user_id, d.subject, d.completed_goals, d.achieved_items
+    FROM unnest(%s::integer[], %s::varchar[], %s::integer[], %s::integer[])
+        WITH ORDINALITY AS d(user_id, subject, completed_goals, achieved_items, ord)
+    JOIN progress_versions v ON v.user_id = d.user_id AND v.summary_catalog_version = %s
+    ORDER BY d.ord
+    ON CONFLICT (user_id, subject) DO UPDATE SET
+        completed_goals = progress_summary.completed_goals + EXCLUDED.completed_goals,
+        achieved_items = progress_summary.achieved_items + EXCLUDED.achieved_items
+"""
+
+
+def goal_bit(level, goal_index):
+    """レベル・ゴール番号のビット位置（保存できない組み合わせの場合はNone）"""
+    if level not in GOAL_LEVELS:
+        return None
+    try:
+        goal_index = int(goal_index)
+    except (TypeError, ValueError):
+        return None
+    if not 0 <= goal_index < GOALS_PER_LEVEL:
+        return None
+    return GOAL_LEVELS.index(level) * GOALS_PER_LEVEL + goal_index
+
+
+def _expand_bits(item_identifier, done, touched):
+    """1行のビットマスクをAPIの進捗行に展開"""
+    rows = []
+    bit = 0
+    while touched >> bit:
+        if touched >> bit & 1:
+            level_index, goal_index = divmod(bit, GOALS_PER_LEVEL)
+            rows.append({
+                'item_identifier': item_identifier,
+                'level': GOAL_LEVELS[level_index],
+                'goal_index': goal_index,
+                'completed': bool(done >> bit & 1)
+            })
+        bit += 1
+    return rows
+
+
+def _is_achieved(completed, total_goals):
+    """学習項目を達成済みとみなすか（進捗率が50%超。progress-manager.jsのMath.roundと同じ丸め）"""
+    return total_goals > 0 and (200 * completed + total_goals) // (2 * total_goals) > 50
+
+
+def _item_summary(catalog, item_identifier, done):
+    """1項目の (教科, 完了ゴール数, 達成なら1) 。カタログに無い・教科未設定の項目はNone"""
+    item = catalog.get(item_identifier)
+    if item is None or item.subject is None:
+        return None
+    completed = bin(done).count('1')
+    return item.subject, completed, int(_is_achieved(completed, item.total_goals))
+
+
+def _apply_summary_deltas(cur, changes, catalog):
+    """書き込んだ行の変化 (user_id, item_identifier, prev_done, done) を教科ごとの集計に反映
+
+    カタログが未読み込みの場合や、集計時と異なるカタログで書き込んだ場合（カタログの再読み込み直後等）は
+    差分を加算できないため、書き込んだ全ユーザーの集計を無効にして次回の読み込み時に再集計させる
+    """
+    if not changes:
+        return
+    user_ids = sorted({change[0] for change in changes})
+    if catalog is None:
+        cur.execute("UPDATE progress_versions SET summary_catalog_version = NULL WHERE user_id = ANY(%s)",
+                    (user_ids,))
+        return
+    cur.execute("""
+        UPDATE progress_versions SET summary_catalog_version = NULL
+        WHERE user_id = ANY(%s) AND summary_catalog_version IS DISTINCT FROM %s
+    """, (user_ids, catalog.version))
+    deltas = {}  # (user_id, subject) -> [完了ゴール数の差, 達成項目数の差]
+    for user_id, item_identifier, prev_done, done in changes:
+        if prev_done == done:
+            continue
+        before = _item_summary(catalog, item_identifier, prev_done)
+        after = _item_summary(catalog, item_identifier, done)
+        if after is None:
+            continue
+        delta = deltas.setdefault((user_id, after[0]), [0, 0])
+        delta[0] += after[1] - before[1]
+        delta[1] += after[2] - before[2]
+    # 集計行のロック順序も揃える（ユーザーID・教科の昇順）
+    deltas = {key: delta for key, delta in sorted(deltas.items()) if delta != [0, 0]}
+    if deltas:
+        cur.execute(_SUMMARY_DELTA_SQL, (
+            [user_id for user_id, _ in deltas], [subject for _, subject in deltas],
+            [delta[0] for delta in deltas.values()], [delta[1] for delta in deltas.values()],
+            catalog.version
+        ))
+
+
+def get_progress_version(cur, user_id):
+    """ユーザーの現在の進捗バージョン（未記録の場合は0）"""
+    cur.execute("SELECT version FROM progress_versions WHERE user_id = %s", (user_id,))
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+
+def collapse_progress_rows(rows):
+    """進捗行 (item_identifier, level, goal_index, completed) を学習項目ごとのビットマスクにまとめる
+
+    行はgoal_bit()で検証済みであること。同じゴールへの書き込みが複数ある場合は最後の値を使う
+    （戻り値: {item_identifier: [done, touched]}）
+    """
+    masks = {}
+    for item_identifier, level, goal_index, completed in rows:
+        mask = 1 << goal_bit(level, goal_index)
+        done_touched = masks.setdefault(item_identifier, [0, 0])
+        done_touched[0] = (done_touched[0] & ~mask) | (mask if completed else 0)
+        done_touched[1] |= mask
+    return masks
+
+
+def upsert_progress_many(cur, rows_by_user, updated_at, catalog):
+    """ユーザーごとの進捗行 {user_id: [(item_identifier, level, goal_index, completed), ...]} を1つの文で書き込み、
+    同じトランザクションで教科ごとの集計も更新する
+
+    戻り値: {user_id: 新しい進捗バージョン}
+
+    行はユーザーID・学習項目の昇順で書き込む（同じユーザーを含む書き込みが同時に実行されても、
+    行ロックを同じ順序で取得するためデッドロックしない）
+    """
+    params = {'user_ids': [], 'row_user_ids': [], 'items': [], 'done': [], 'touched': [], 'updated_at': updated_at}
+    for user_id, rows in sorted(rows_by_user.items()):
+        params['user_ids'].append(user_id)
+        for item_identifier, (done, touched) in sorted(collapse_progress_rows(rows).items()):
+            params['row_user_ids'].append(user_id)
+            params['items'].append(item_identifier)
+            params['done'].append(done)
+            params['touched'].append(touched)
+    cur.execute(_UPSERT_SQL, params)
+    versions = {}
+    changes = []
+    for user_id, version, item_identifier, prev_done, done in cur.fetchall():
+        versions[user_id] = version
+        changes.append((user_id, item_identifier, prev_done, done))
+    _apply_summary_deltas(cur, changes, catalog)
+    return versions
+
+
+def upsert_progress(cur, user_id, rows, updated_at, catalog):
+    """進捗行 (item_identifier, level, goal_index, completed) を書き込み、新しい進捗バージョンを返す"""
+    return upsert_progress_many(cur, {int(user_id): rows}, updated_at, catalog)[int(user_id)]
+
+
+def fetch_progress(user_id, since=None):
+    """ユーザーの進捗を取得（戻り値: (現在の進捗バージョン, 行の辞書のリスト)）
+
+    sinceを指定した場合は、そのバージョンより後に書き込まれた学習項目の行のみを返す
+    （sinceが現在より新しい場合はデータが作り直されているため全件を返す）。
+    バージョンを先に読むため、同時に書き込まれた行は次回の差分にも含まれる（冪等なので問題ない）
+    """
+    with db_manager.get_connection() as conn:
+        with conn.cursor() as cur:
+            version = get_progress_version(cur, user_id)
+            if since is not None and since > version:
+                since = None
+            if since == version:
+                return version, []
+            if since is None:
+                cur.execute("SELECT item_identifier, done, touched FROM progress_bits WHERE user_id = %s", (user_id,))
+            else:
+                cur.execute("SELECT item_identifier, done, touched FROM progress_bits WHERE user_id = %s AND version > %s",
+                            (user_id, since))
+            rows = [row for item_identifier, done, touched in cur.fetchall()
+                    for row in _expand_bits(item_identifier, done, touched)]
+    return version, rows
+
+
+def _rebuild_progress_summary(cur, user_id, catalog):
+    """ユーザーの教科ごとの集計をprogress_bitsから作り直す（カタログ更新後・移行直後に使う）"""
+    cur.execute("SELECT item_identifier, done FROM progress_bits WHERE user_id = %s", (user_id,))
+    totals = {}  # 教科 -> [完了ゴール数, 達成項目数]
+    for item_identifier, done in cur.fetchall():
+        summary = _item_summary(catalog, item_identifier, done)
+        if summary is None:
+            continue
+        total = totals.setdefault(summary[0], [0, 0])
+        total[0] += summary[1]
+        total[1] += summary[2]
+    cur.execute("DELETE FROM progress_summary WHERE user_id = %s", (user_id,))
+    cur.executemany(
+        "INSERT INTO progress_summary (user_id, subject, completed_goals, achieved_items) VALUES (%s, %s, %s, %s)",
+        [(user_id, subject, completed_goals, achieved_items) for subject, (completed_goals, achieved_items) in totals.items()]
+    )
+    cur.execute("UPDATE progress_versions SET summary_catalog_version = %s WHERE user_id = %s",
+                (catalog.version, user_id))
+
+
+def fetch_progress_summary(user_id, catalog):
+    """ユーザーの教科ごとの集計を取得（戻り値: (現在の進捗バージョン, {教科: (完了ゴール数, 達成項目数)})）
+
+    集計したときとカタログが異なる場合（項目の追加・ゴール数の変更等）は、その場で作り直す
+    """
+    with db_manager.get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT version, summary_catalog_version FROM progress_versions WHERE user_id = %s", (user_id,))
+            row = cur.fetchone()
+            if row is None or row[1] != catalog.version:
+                # 進捗の書き込みと同じ行ロックで直列化して再集計
+                cur.execute("INSERT INTO progress_versions (user_id, version) VALUES (%s, 0) ON CONFLICT (user_id) DO NOTHING",
+                            (user_id,))
+                cur.execute("SELECT version, summary_catalog_version FROM progress_versions WHERE user_id = %s FOR UPDATE",
+                            (user_id,))
+                row = cur.fetchone()
+                if row[1] != catalog.version:
+                    _rebuild_progress_summary(cur, user_id, catalog)
+                conn.commit()
+            cur.execute("SELECT subject, completed_goals, achieved_items FROM progress_summary WHERE user_id = %s",
+                        (user_id,))
+            subjects = {subject: (completed_goals, achieved_items) for subject, completed_goals, achieved_items in cur.fetchall()}
+    return row[0], subjects
+
+
+def migrate_legacy_progress(cur):
+    """旧形式（1ゴール1行）のprogressテーブルをprogress_bitsに移行し、progress_legacyに改名する
+
+    複数ワーカーが同時に起動しても1回だけ実行されるよう、アドバイザリロックで直列化する。
+    移行中に新形式で書き込まれたゴールは新しい値を優先する
+    """
+    cur.execute("SELECT pg_advisory_xact_lock(hashtext('progress_bits_migration'))")
+    cur.execute("SELECT to_regclass('progress') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        return
+
+    levels = list(GOAL_LEVELS)
+    valid = "array_position(%(levels)s::text[], level::text) IS NOT NULL AND goal_index BETWEEN 0 AND %(max_index)s"
+    params = {'levels': levels, 'max_index': GOALS_PER_LEVEL - 1, 'goals_per_level': GOALS_PER_LEVEL}
+    cur.execute(f"""
+        INSERT INTO progress_bits (user_id, item_identifier, done, touched, version, updated_at)
+        SELECT user_id, item_identifier,
+               bit_or(CASE WHEN completed THEN bit ELSE 0 END), bit_or(bit), 0, max(updated_at)
+        FROM (
+            SELECT user_id, item_identifier, completed, updated_at,
+                   1::bigint << ((array_position(%(levels)s::text[], level::text) - 1) * %(goals_per_level)s + goal_index) AS bit
+            FROM progress
+            WHERE {valid}
+        ) legacy
+        GROUP BY user_id, item_identifier
+        ON CONFLICT (user_id, item_identifier) DO UPDATE SET
+            done = (EXCLUDED.done & ~progress_bits.touched) | progress_bits.done,
+            touched = progress_bits.touched | EXCLUDED.touched
+    """, params)
+    migrated = cur.rowcount
+    cur.execute(f"SELECT count(*) FROM progress WHERE NOT ({valid})", params)
+    skipped = cur.fetchone()[0]
+    cur.execute("ALTER TABLE progress RENAME TO progress_legacy")
+    print(f"[DB] 進捗をビットマスク形式に移行しました: {migrated}件の学習項目（旧テーブルはprogress_legacyに保存）")
+    if skipped:
+        print(f"[DB] WARNING: 保存できないレベル・ゴール番号の旧進捗 {skipped}件は移行していません")
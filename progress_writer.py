@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+進捗書き込みのグループコミットモジュール
+PROGRESS_GROUP_COMMIT=1 の場合、/api/progress/update の単発の書き込みを数ミリ秒ためて、
+複数ユーザー分を1つのトランザクション（1つのUPSERT文）でコミットする
+（応答はコミット完了後に返すため、書き込みの永続性は個別にコミットする場合と同じ）
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from datetime import datetime
+
+from database import db_manager
+from progress import upsert_progress_many
+
+PROGRESS_GROUP_COMMIT = os.environ.get('PROGRESS_GROUP_COMMIT', '0') == '1'
+# 最初の書き込みが届いてからコミットまで待つ時間（ミリ秒）と、1回のコミットにまとめる最大件数
+PROGRESS_GROUP_COMMIT_WINDOW_MS = float(os.environ.get('PROGRESS_GROUP_COMMIT_WINDOW_MS', '5'))
+PROGRESS_GROUP_COMMIT_MAX_BATCH = int(os.environ.get('PROGRESS_GROUP_COMMIT_MAX_BATCH', '200'))
+# コミット待ちの上限（超えた場合は即座に503を返す）と、1回の書き込みの最大待ち時間（秒）
+PROGRESS_GROUP_COMMIT_MAX_QUEUE = int(os.environ.get('PROGRESS_GROUP_COMMIT_MAX_QUEUE', '1000'))
+PROGRESS_WRITE_TIMEOUT = float(os.environ.get('PROGRESS_WRITE_TIMEOUT', '10'))
+
+
+class ProgressQueueFullError(Exception):
+    """コミット待ちの進捗書き込みが上限に達している"""
+
+
+class ProgressGroupCommitter:
+    """進捗の書き込みをまとめて1つのトランザクションでコミットする書き込みキュー"""
+
+    def __init__(self, window, max_batch, max_queue):
+        self.window = window
+        self.max_batch = max_batch
+        self.max_queue = max_queue
+        self._pending = deque()  # (user_id, 進捗行のリスト, カタログ, Future)
+        self._cond = threading.Condition()
+        self._thread = None
+        self.commits = 0
+        self.writes = 0
+        self.failures = 0
+
+    def submit(self, user_id, rows, catalog):
+        """書き込みをキューに追加（結果は新しい進捗バージョンのFuture。上限に達している場合はProgressQueueFullError）
+
+        catalogは教科ごとの集計の更新に使う（まとめた書き込みのうち最後のものを使う）
+        """
+        future = Future()
+        with self._cond:
+            if len(self._pending) >= self.max_queue:
+                raise ProgressQueueFullError()
+            self._pending.append((int(user_id), rows, catalog, future))
+            if self._thread is None or not self._thread.is_alive():
+                # gunicornのワーカーごとに、初回の書き込み時に開始
+                self._thread = threading.Thread(target=self._run, name='progress-writer', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def write(self, user_id, rows, catalog, timeout=PROGRESS_WRITE_TIMEOUT):
+        """書き込みをキューに追加し、コミット完了を待って新しい進捗バージョンを返す（timeout秒で TimeoutError）"""
+        return self.submit(user_id, rows, catalog).result(timeout=timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                # 最初の書き込みからwindow秒の間に届いた書き込みもまとめる（最大件数に達したら即座にコミット）
+                deadline = time.monotonic() + self.window
+                while len(self._pending) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = [self._pending.popleft() for _ in range(min(self.max_batch, len(self._pending)))]
+            self._flush(batch)
+
+    def _flush(self, batch):
+        """まとめた書き込みをコミットし、各リクエストに結果を返す"""
+        rows_by_user = {}
+        catalog = None
+        for user_id, rows, entry_catalog, _ in batch:
+            # 同じユーザーの書き込みは届いた順に連結（同じゴールは後の値が優先される）
+            rows_by_user.setdefault(user_id, []).extend(rows)
+            catalog = entry_catalog or catalog
+        try:
+            versions = self._commit(rows_by_user, catalog)
+        except Exception as e:
+            print(f"[DB] ERROR: 進捗のグループコミットに失敗しました（{len(batch)}件）: {e}")
+            if len(rows_by_user) == 1:
+                self.failures += 1
+                for *_, future in batch:
+                    future.set_exception(e)
+                return
+            # 1人分の不正なデータで他のユーザーの書き込みが失敗しないよう、ユーザーごとにコミットし直す
+            versions = {}
+            for user_id, rows in rows_by_user.items():
+                try:
+                    versions.update(self._commit({user_id: rows}, catalog))
+                except Exception as user_error:
+                    self.failures += 1
+                    versions[user_id] = user_error
+        self.commits += 1
+        self.writes += len(batch)
+        for user_id, *_, future in batch:
+            result = versions.get(user_id)
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def _commit(self, rows_by_user, catalog):
+        with db_manager.get_connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    versions = upsert_progress_many(cur, rows_by_user, datetime.now(), catalog)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return versions
+
+    def stats(self):
+        """書き込みキューの利用状況（1回のコミットあたりの平均書き込み件数等）"""
+        with self._cond:
+            pending = len(self._pending)
+        return {
+            'enabled': PROGRESS_GROUP_COMMIT,
+            'pending': pending,
+            'maxQueue': self.max_queue,
+            'commits': self.commits,
+            'writes': self.writes,
+            'failures': self.failures,
+            'writesPerCommit': round(self.writes / self.commits, 2) if self.commits else None
+        }
+
+
+# プロセス全体で共有する進捗書き込みキュー（PROGRESS_GROUP_COMMIT=1 の場合のみ使用）
+progress_writer = ProgressGroupCommitter(
+    window=PROGRESS_GROUP_COMMIT_WINDOW_MS / 1000,
+    max_batch=PROGRESS_GROUP_COMMIT_MAX_BATCH,
+    max_queue=PROGRESS_GROUP_COMMIT_MAX_QUEUE
+)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+レート制限モジュール
+AI生成・APIキーテスト・ログイン等の重いエンドポイントを、ユーザー・IPごとのトークンバケットで制限する
+（制限超過時はDB・Geminiの処理を行う前に 429 + Retry-After を返す）
+
+RATE_LIMIT_BACKEND=postgres でバケットをDBに保存し、全ワーカーで共有する（既定はワーカーごとのメモリ）
+"""
+
+import math
+import os
+import threading
+import time
+from functools import wraps
+
+from flask import jsonify, request, session
+
+from database import db_manager
+
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+# アプリの前段にあるプロキシの数（X-Forwarded-Forの末尾から数えてクライアントIPを取得。Renderは1）
+RATE_LIMIT_PROXY_COUNT = int(os.environ.get('RATE_LIMIT_PROXY_COUNT', '1'))
+
+# エンドポイント別のポリシー: (対象, バケット容量, 容量分が回復する秒数)
+# 対象 user はログイン中のみ適用（未ログインの場合は ip のバケットのみ）
+RATE_LIMIT_POLICIES = {
+    'ai': (('user', 10, 60), ('ip', 30, 60)),
+    'test_api_key': (('ip', 3, 60),),
+    'login': (('ip', 10, 60),),
+    'register': (('ip', 5, 600),),
+}
+
+# メモリ上に保持するバケット数の上限
+MEMORY_BUCKET_MAX_SIZE = 10000
+
+
+class MemoryBucketStore:
+    """ワーカーのメモリ上のトークンバケット"""
+
+    def __init__(self, max_size=MEMORY_BUCKET_MAX_SIZE):
+        self.max_size = max_size
+        self._buckets = {}  # key -> (トークン数, 更新時刻)
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate, cost=1):
+        """トークンをcost個消費（戻り値: (許可されたか, 再試行までの秒数)）"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            if key not in self._buckets and len(self._buckets) >= self.max_size:
+                self._purge(now)
+            self._buckets[key] = (tokens, now)
+        return allowed, 0 if allowed else (cost - tokens) / rate
+
+    def refund(self, key, capacity, cost=1):
+        """take() で消費したトークンを戻す（同じ判定の他のバケットで拒否された場合）"""
+        with self._lock:
+            if key in self._buckets:
+                tokens, updated = self._buckets[key]
+                self._buckets[key] = (min(capacity, tokens + cost), updated)
+
+    def _purge(self, now):
+        """1時間以上使われていないバケットを削除（それでも上限を超える場合は全て破棄）"""
+        for key in [key for key, (_, updated) in self._buckets.items() if now - updated > 3600]:
+            del self._buckets[key]
+        if len(self._buckets) >= self.max_size:
+            self._buckets.clear()
+
+
+class PostgresBucketStore:
+    """rate_limit_bucketsテーブルのトークンバケット（全ワーカーで共有、1回のUPSERTで判定）"""
+
+    # 経過時間分を回復したトークン数（UPDATEのSET内では b.* は更新前の値）
+    _REFILLED = "LEAST(%(capacity)s, b.tokens + EXTRACT(EPOCH FROM (now() - b.updated_at))::float8 * %(rate)s)"
+    _SQL = f"""
+        INSERT INTO rate_limit_buckets AS b (key, tokens, allowed, updated_at)
+        VALUES (%(key)s, %(capacity)s - %(cost)s, TRUE, now())
+        ON CONFLICT (key) DO UPDATE SET
+            allowed = {_REFILLED} >= %(cost)s,
+            tokens = {_REFILLED} - CASE WHEN {_REFILLED} >= %(cost)s THEN %(cost)s ELSE 0 END,
+            updated_at = now()
+        RETURNING tokens, allowed
+    """
+    _REFUND_SQL = "UPDATE rate_limit_buckets SET tokens = LEAST(%s, tokens + %s) WHERE key = %s"
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+
+    def take(self, key, capacity, rate, cost=1):
+        try:
+            with db_manager.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(self._SQL, {'key': key, 'capacity': float(capacity),
+                                            'rate': float(rate), 'cost': float(cost)})
+                    tokens, allowed = cur.fetchone()
+                    conn.commit()
+        except Exception as e:
+            # DBに接続できない場合はワーカーごとの制限で継続
+            print(f"[RATE] WARNING: 共有バケットを利用できないためメモリで判定します: {e}")
+            return self.fallback.take(key, capacity, rate, cost)
+        return allowed, 0 if allowed else (cost - tokens) / rate
+
+    def refund(self, key, capacity, cost=1):
+        try:
+            with db_manager.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(self._REFUND_SQL, (float(capacity), float(cost), key))
+                    conn.commit()
+        except Exception as e:
+            print(f"[RATE] WARNING: 共有バケットにトークンを戻せませんでした: {e}")
+            self.fallback.refund(key, capacity, cost)
+
+
+_memory_store = MemoryBucketStore()
+bucket_store = PostgresBucketStore(_memory_store) if RATE_LIMIT_BACKEND == 'postgres' else _memory_store
+
+
+def client_ip():
+    """クライアントのIPアドレス（プロキシ経由の場合はX-Forwarded-Forから取得）"""
+    forwarded = request.headers.get('X-Forwarded-For')
+    if forwarded and RATE_LIMIT_PROXY_COUNT > 0:
+        addresses = [address.strip() for address in forwarded.split(',') if address.strip()]
+        if addresses:
+            # 末尾は信頼できるプロキシが付加した値（先頭はクライアントが偽装できる）
+            return addresses[max(0, len(addresses) - RATE_LIMIT_PROXY_COUNT)]
+    return request.remote_addr or 'unknown'
+
+
+def check_rate_limit(policy_name):
+    """ポリシーの全バケットからトークンを消費（戻り値: 再試行までの秒数、許可された場合はNone）
+
+    いずれかのバケットで拒否された場合は、残りのバケットは消費せず、消費済みのバケットにはトークンを戻す
+    （拒否されたリクエストの再試行で、他のバケットの制限が延びないようにする）
+    """
+    taken = []
+    for scope, capacity, period in RATE_LIMIT_POLICIES[policy_name]:
+        if scope == 'user':
+            subject = session.get('user_id')
+            if subject is None:
+                continue
+        else:
+            subject = client_ip()
+        key = f"{policy_name}:{scope}:{subject}"
+        allowed, wait = bucket_store.take(key, capacity, capacity / period)
+        if not allowed:
+            for taken_key, taken_capacity in taken:
+                bucket_store.refund(taken_key, taken_capacity)
+            return wait
+        taken.append((key, capacity))
+    return None
+
+
+def rate_limit_response(retry_after):
+    """レート制限超過時のレスポンス"""
+    seconds = max(1, math.ceil(retry_after))
+    response = jsonify({
+        'success': False,
+        'code': 'RATE_LIMITED',
+        'error': f'リクエストが多すぎます。{seconds}秒後に再度お試しください。'
+    })
+    response.headers['Retry-After'] = str(seconds)
+    return response, 429
+
+
+def rate_limited(policy_name, methods=('POST',)):
+    """エンドポイントにレート制限を適用するデコレーター（login_requiredより外側に付ける）"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if RATE_LIMIT_ENABLED and request.method in methods:
+                retry_after = check_rate_limit(policy_name)
+                if retry_after is not None:
+                    print(f"[RATE] 制限超過: {policy_name} ip={client_ip()} user={session.get('user_id')}")
+                    return rate_limit_response(retry_after)
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
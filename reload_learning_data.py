@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """
 学習データの再読み込みスクリプト
-既存のlearning_itemsテーブルをクリアして、正しくsubject情報を含めて再作成
+learning_data.tsvとlearning_itemsの差分（内容が変わった行のみ）を反映
 """
 
 import os
@@ -21,16 +21,11 @@ def reload_learning_data():
     try:
         print("[RELOAD] 学習データの再読み込みを開始...")
         
-        # 既存のlearning_itemsテーブルを削除
-        with db_manager.get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("DELETE FROM learning_items")
-                conn.commit()
-                print("[RELOAD] 既存のlearning_itemsデータを削除しました")
-        
-        # 学習データを再読み込み
-        from database import _load_learning_data
-        _load_learning_data()
+        # 変更された行だけを1トランザクションで反映（実行中のワーカーはバージョン確認で差し替え）
+        from database import sync_learning_data
+        result = sync_learning_data()
+        print(f"[RELOAD] 差分反映: {result['upserted']}件更新, {result['deleted']}件削除 "
+              f"(カタログバージョン {result['version']})")
         
         # 結果を確認
         with db_manager.get_connection() as conn:
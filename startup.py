@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+起動時間の計測モジュール
+import・初期化の各ステップにかかった時間を記録し、起動レポートとして出力する
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StartupReport:
+    """起動ステップごとの所要時間を記録"""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.steps = []  # (ステップ名, 秒数)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def step(self, name):
+        """withブロックの所要時間をステップとして記録"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name, seconds):
+        """ステップの所要時間を記録"""
+        with self._lock:
+            self.steps.append((name, seconds))
+
+    def as_dict(self):
+        """JSON出力用の辞書を作成"""
+        with self._lock:
+            steps = list(self.steps)
+        return {
+            'elapsedSinceStart': round(time.perf_counter() - self.started_at, 4),
+            'steps': [{'name': name, 'seconds': round(seconds, 4)} for name, seconds in steps]
+        }
+
+    def print_report(self, title):
+        """起動レポートをログに出力"""
+        report = self.as_dict()
+        print(f"[STARTUP] ===== {title} ({report['elapsedSinceStart']:.3f}s since start) =====")
+        for step in report['steps']:
+            print(f"[STARTUP]   {step['name']:<40} {step['seconds'] * 1000:9.1f} ms")
+
+
+# プロセス全体で共有するレポート
+startup_report = StartupReport()
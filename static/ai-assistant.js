@@ -24,9 +24,11 @@ class AiAssistant {
         console.log('searchInput値:', searchInput?.value);
         
         if (breadcrumb) {
-            // 学習項目ページ - 詳細情報も取得
-            const identifier = breadcrumb.textContent.trim();
-            const contentElement = document.querySelector('[data-content-info]');
+            // 学習項目ページ（学習内容はサーバー側で識別子からカタログを引いて組み立てる）
+            const contentElement = document.querySelector('[data-identifier]');
+            const identifier = contentElement
+                ? contentElement.getAttribute('data-identifier')
+                : breadcrumb.textContent.trim();
             
             this.currentContext = {
                 type: 'content',
@@ -34,25 +36,6 @@ class AiAssistant {
                 message: `「${identifier}」について詳しく説明できます`
             };
             
-            // 詳細情報を取得
-            if (contentElement) {
-                try {
-                    const contentInfo = JSON.parse(contentElement.getAttribute('data-content-info'));
-                    this.currentContext.contentData = contentInfo;
-                    console.log('📚 学習データ取得成功:', contentInfo);
-                } catch (error) {
-                    console.log('❌ 学習データ取得失敗:', error);
-                    // フォールバック: 画面から直接取得
-                    const goalElement = document.querySelector('.goal-description');
-                    const keywordElements = document.querySelectorAll('.keyword-tag');
-                    
-                    this.currentContext.fallbackData = {
-                        learningObjective: goalElement?.textContent || '',
-                        keywords: Array.from(keywordElements).map(el => el.textContent)
-                    };
-                }
-            }
-            
             console.log('✅ コンテンツページ検出:', this.currentContext);
         } else if (searchInput && searchInput.value.trim()) {
             // 検索中
@@ -222,15 +205,33 @@ class AiAssistant {
             }
             console.log('✅ APIマネージャーが見つかりました');
             console.log('📡 AI呼び出し開始');
-            const data = await window.apiManager.callAI(contextualPrompt, 'Learning Assistant');
+            // 生成途中のテキストを逐次表示（最初のチャンクでローディングを置き換え）
+            let streamingEl = null;
+            const identifier = this.currentContext?.type === 'content' ? this.currentContext.identifier : null;
+            const data = await window.apiManager.callAIStream(contextualPrompt, 'Learning Assistant', (chunk, partial) => {
+                if (!streamingEl) {
+                    this.removeLoadingMessage(loadingId);
+                    streamingEl = this.addStreamingMessage();
+                }
+                this.updateStreamingMessage(streamingEl, partial);
+            }, identifier);
             console.log('📡 AI呼び出し完了:', data);
 
             // ローディング削除
             this.removeLoadingMessage(loadingId);
 
             if (data.success) {
-                this.addMessage('assistant', data.result);
+                if (streamingEl) {
+                    // 完了後は通常のメッセージと同じ整形で表示し直す
+                    this.renderMessageContent(streamingEl, 'assistant', data.result);
+                    this.messages.push({ type: 'assistant', content: data.result, timestamp: Date.now() });
+                } else {
+                    this.addMessage('assistant', data.result);
+                }
             } else {
+                if (streamingEl) {
+                    streamingEl.remove();
+                }
                 this.showSystemMessage('エラー: ' + data.error);
             }
 
@@ -244,53 +245,12 @@ class AiAssistant {
         this.setSendButtonState(true);
     }
 
-    // コンテキスト付きプロンプトを構築
+    // 送信するプロンプトを構築（学習項目の内容・回答の指示はサーバー側で付加する）
     buildContextualPrompt(userMessage) {
-        let contextInfo = '';
-        
-        console.log('🧠 プロンプト構築中...');
-        console.log('現在のコンテキスト:', this.currentContext);
-        
-        if (this.currentContext?.type === 'content') {
-            const data = this.currentContext.contentData || this.currentContext.fallbackData;
-            
-            if (data) {
-                contextInfo = `
-【現在の学習項目】
-• 識別子: ${this.currentContext.identifier}
-• 教科: ${data.subject || '未設定'}
-• 学年: ${data.grade ? data.grade + '年生' : '未設定'}
-• 学習目標: ${data.learningObjective || '未設定'}
-• キーワード: ${Array.isArray(data.keywords) ? data.keywords.join(', ') : '未設定'}
-
-【学習ゴール】
-${data.beginnerGoals ? '初心者: ' + data.beginnerGoals.join(', ') : ''}
-${data.intermediateGoals ? '中級者: ' + data.intermediateGoals.join(', ') : ''}
-${data.advancedGoals ? '上級者: ' + data.advancedGoals.join(', ') : ''}
-                `;
-            } else {
-                contextInfo = `現在、学習項目「${this.currentContext.identifier}」について学習中です。`;
-            }
-        } else if (this.currentContext?.type === 'search') {
-            contextInfo = `現在、「${this.currentContext.query}」について検索中です。`;
+        if (this.currentContext?.type === 'search') {
+            return `現在、「${this.currentContext.query}」について検索中です。\n${userMessage}`;
         }
-
-        const finalPrompt = `あなたは不登校の子どもたちをサポートする優しい教育アシスタントです。
-${contextInfo}
-
-ユーザーからの質問: ${userMessage}
-
-以下の点を意識して回答してください：
-- 短く、分かりやすい説明（200文字程度）
-- マークダウン記法は使わない（普通の文章で）
-- 温かく励ましの気持ちを込める
-- プレッシャーを与えない表現
-- 具体的で実践しやすいアドバイス
-
-簡潔で読みやすい文章で答えてください。`;
-
-        console.log('📝 構築されたプロンプト:', finalPrompt);
-        return finalPrompt;
+        return userMessage;
     }
 
     // メッセージを追加
@@ -306,7 +266,7 @@ ${contextInfo}
 
         const messageEl = document.createElement('div');
         messageEl.className = `chat-message ${type}`;
-        messageEl.textContent = content;
+        this.renderMessageContent(messageEl, type, content);
         
         messagesContainer.appendChild(messageEl);
         messagesContainer.scrollTop = messagesContainer.scrollHeight;
@@ -314,6 +274,53 @@ ${contextInfo}
         this.messages.push({ type, content, timestamp: Date.now() });
     }
 
+    // メッセージ本文を表示（アシスタントの回答は簡易マークダウンを整形、それ以外はテキストのまま）
+    renderMessageContent(messageEl, type, content) {
+        if (type === 'assistant' && window.apiManager) {
+            // 回答中のHTMLはエスケープしてから整形する
+            const escaped = content
+                .replace(/&/g, '&amp;')
+                .replace(/</g, '&lt;')
+                .replace(/>/g, '&gt;');
+            messageEl.innerHTML = window.apiManager.markdownToHtml(escaped);
+        } else {
+            messageEl.textContent = content;
+        }
+
+        const messagesContainer = document.getElementById('aiChatMessages');
+        if (messagesContainer) {
+            messagesContainer.scrollTop = messagesContainer.scrollHeight;
+        }
+    }
+
+    // ストリーミング表示用のアシスタントメッセージを追加
+    addStreamingMessage() {
+        const messagesContainer = document.getElementById('aiChatMessages');
+        if (!messagesContainer) return null;
+
+        // ウェルカムメッセージを非表示
+        const welcome = document.querySelector('.ai-chat-welcome');
+        if (welcome) {
+            welcome.style.display = 'none';
+        }
+
+        const messageEl = document.createElement('div');
+        messageEl.className = 'chat-message assistant';
+        messagesContainer.appendChild(messageEl);
+        return messageEl;
+    }
+
+    // ストリーミング中のメッセージ内容を更新（生成途中はテキストのまま表示し、完了後にrenderMessageContentで整形）
+    updateStreamingMessage(messageEl, content) {
+        if (!messageEl) return;
+        messageEl.textContent = content;
+
+        const messagesContainer = document.getElementById('aiChatMessages');
+        if (messagesContainer) {
+            messagesContainer.scrollTop = messagesContainer.scrollHeight;
+        }
+    }
+
     // ローディングメッセージを追加
     addLoadingMessage() {
         const messagesContainer = document.getElementById('aiChatMessages');
@@ -249,43 +249,10 @@ class APIKeyManager {
         this.saveCurrentContext();
     }
 
-    // 現在のコンテキスト情報を保存
+    // 現在の学習項目の識別子を保存（学習内容はサーバー側でカタログから組み立てる）
     saveCurrentContext() {
-        const currentContext = {};
-        
-        // content画面かどうかを判定
-        if (window.location.pathname.includes('/content/')) {
-            currentContext.page_type = 'content';
-            
-            // content画面のデータを取得
-            const contentElement = document.querySelector('[data-content-info]');
-            if (contentElement) {
-                try {
-                    const contentInfo = JSON.parse(contentElement.getAttribute('data-content-info'));
-                    console.log('コンテキスト情報:', contentInfo); // デバッグ用
-                    currentContext.learning_objective = contentInfo.learningObjective || '';
-                    currentContext.subject = contentInfo.subject || '';
-                    currentContext.grade = contentInfo.grade || '';
-                    currentContext.keywords = contentInfo.keywords || [];
-                    currentContext.beginner_goals = contentInfo.beginnerGoals || [];
-                    currentContext.intermediate_goals = contentInfo.intermediateGoals || [];
-                    currentContext.advanced_goals = contentInfo.advancedGoals || [];
-                } catch (error) {
-                    console.log('コンテキスト情報の取得に失敗:', error);
-                    // フォールバック: 画面から直接データを取得
-                    const learningGoalElement = document.querySelector('.goal-description');
-                    if (learningGoalElement) {
-                        currentContext.learning_objective = learningGoalElement.textContent || '';
-                    }
-                    const keywordElements = document.querySelectorAll('.keyword-tag');
-                    currentContext.keywords = Array.from(keywordElements).map(el => el.textContent);
-                }
-            }
-        } else {
-            currentContext.page_type = 'home';
-        }
-        
-        this.currentContext = currentContext;
+        const contentElement = document.querySelector('[data-identifier]');
+        this.currentIdentifier = contentElement ? contentElement.getAttribute('data-identifier') : null;
     }
 
     // AIプロンプトモーダルを閉じる
@@ -295,7 +262,7 @@ class APIKeyManager {
     }
 
     // 共通のAI呼び出しメソッド
-    async callAI(prompt, contentType = '') {
+    async callAI(prompt, contentType = '', identifier = this.currentIdentifier) {
         // 認証チェック
         if (!window.authManager || !window.authManager.isLoggedIn()) {
             throw new Error('ログインが必要です。');
@@ -320,7 +287,7 @@ class APIKeyManager {
                 body: JSON.stringify({
                     prompt: prompt,
                     content_type: contentType,
-                    context: this.currentContext || {}
+                    identifier: identifier || null
                 })
             });
 
@@ -355,6 +322,102 @@ class APIKeyManager {
         }
     }
 
+    // AI呼び出し（ストリーミング版）: 生成途中のテキストをonChunkに逐次渡す
+    async callAIStream(prompt, contentType = '', onChunk = () => {}, identifier = this.currentIdentifier) {
+        // 認証チェック
+        if (!window.authManager || !window.authManager.isLoggedIn()) {
+            throw new Error('ログインが必要です。');
+        }
+
+        // 利用制限チェック
+        if (!window.authManager.canUseAI()) {
+            window.authManager.showUsageLimitModal();
+            throw new Error('利用制限に達しました。');
+        }
+
+        if (!prompt) {
+            throw new Error('プロンプトが空です。');
+        }
+
+        try {
+            const response = await fetch('/api/ai-generate-stream', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify({
+                    prompt: prompt,
+                    content_type: contentType,
+                    identifier: identifier || null
+                })
+            });
+
+            const contentTypeHeader = response.headers.get('Content-Type') || '';
+            if (!contentTypeHeader.includes('text/event-stream')) {
+                // ストリーム開始前のエラー（ログイン・利用制限等）はJSONで返る
+                const data = await response.json();
+                if (data.error === 'USAGE_LIMIT_EXCEEDED' && window.authManager) {
+                    window.authManager.showUsageLimitModal();
+                }
+                return { success: false, error: data.error };
+            }
+
+            if (!response.body || !response.body.getReader) {
+                // ストリーム非対応ブラウザでは通常のAPIにフォールバック
+                return this.callAI(prompt, contentType, identifier);
+            }
+
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            let result = '';
+
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+
+                // イベントは空行区切り
+                let separatorIndex;
+                while ((separatorIndex = buffer.indexOf('\n\n')) !== -1) {
+                    const rawEvent = buffer.slice(0, separatorIndex);
+                    buffer = buffer.slice(separatorIndex + 2);
+
+                    let eventName = 'message';
+                    let dataText = '';
+                    rawEvent.split('\n').forEach(line => {
+                        if (line.startsWith('event:')) {
+                            eventName = line.slice(6).trim();
+                        } else if (line.startsWith('data:')) {
+                            dataText += line.slice(5).trim();
+                        }
+                    });
+                    const payload = dataText ? JSON.parse(dataText) : {};
+
+                    if (eventName === 'chunk') {
+                        result += payload.text;
+                        onChunk(payload.text, result);
+                    } else if (eventName === 'done') {
+                        // 利用回数を更新
+                        if (payload.usage_count !== undefined && window.authManager) {
+                            window.authManager.updateUsageCount(payload.usage_count);
+                        }
+                        return { success: true, result: result };
+                    } else if (eventName === 'error') {
+                        return { success: false, error: payload.error };
+                    }
+                }
+            }
+
+            return { success: false, error: 'AIからの応答が途中で終了しました' };
+        } catch (error) {
+            return {
+                success: false,
+                error: 'ネットワークエラーが発生しました: ' + error.message
+            };
+        }
+    }
+
     // AIプロンプトを実行
     async executeAIPrompt() {
         const prompt = document.getElementById('promptText').value.trim();
@@ -375,7 +438,10 @@ class APIKeyManager {
         resultDiv.innerHTML = '<div class="loading-message"><i class="fas fa-spinner fa-spin"></i> AIが回答を生成中...</div>';
 
         try {
-            const data = await this.callAI(prompt, contentType);
+            // 生成途中のテキストを逐次表示
+            const data = await this.callAIStream(prompt, contentType, (chunk, partial) => {
+                resultDiv.innerHTML = `<div class="ai-result-content">${this.markdownToHtml(partial)}</div>`;
+            });
 
             if (data.success) {
                 // マークダウンを簡易HTMLに変換
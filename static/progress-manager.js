@@ -18,12 +18,18 @@ class ProgressManager {
         this.statsCacheExpiry = null;
         this.STATS_CACHE_DURATION = 30000; // 30秒キャッシュ
         
+        // サーバーで集計済みの進捗（/api/progress-summary、保存するたびに無効化）
+        this.summaryCache = null;
+        
         // 進捗データキャッシュ
         this.progressDataCache = null;
         this.progressCacheExpiry = null;
         this.PROGRESS_CACHE_DURATION = 60000; // 60秒キャッシュ
         this.lastProgressLoadTime = null;
         
+        // 差分同期用: サーバーの進捗バージョン（localStorageにユーザー別で保存）
+        this.progressVersion = null;
+        
         this.init();
     }
 
@@ -263,6 +269,13 @@ class ProgressManager {
                     
                     // キャッシュを無効化（次回アクセス時に最新データを取得）
                     this.invalidateProgressCache();
+                    // 前回同期以降の変更がこの保存だけなら、保存後のバージョンを同期済みとする
+                    // （自分で書き込んだ行を次回の差分取得で再取得しない。他の端末の変更があれば差分で取得）
+                    if (this.progressVersion !== null && data.version === this.progressVersion + 1) {
+                        this.progressVersion = data.version;
+                    }
+                    // 保存済みの状態をスナップショットにも反映（次回は差分のみ取得）
+                    this.saveProgressSnapshot();
                 } else {
                     console.error('❌ バッチ保存失敗:', data.error);
                 }
@@ -298,6 +311,7 @@ class ProgressManager {
     invalidateProgressCache() {
         this.progressDataCache = null;
         this.progressCacheExpiry = null;
+        this.summaryCache = null;
         console.log('🗑️ 進捗データキャッシュを無効化しました');
     }
     
@@ -334,8 +348,22 @@ class ProgressManager {
                 return;
             }
             
+            // 前回同期した状態があれば、そのバージョン以降の差分のみ取得
+            const snapshot = this.progressVersion !== null
+                ? { version: this.progressVersion, data: this.progressData }
+                : this.loadProgressSnapshot();
+            const url = snapshot
+                ? `/api/progress/${this.userId}?since=${snapshot.version}`
+                : `/api/progress/${this.userId}`;
+            
             console.log('🔄 サーバーから進捗データを取得中...');
-            const response = await fetch(`/api/progress/${this.userId}`);
+            const response = await fetch(url);
+            if (response.status === 304 && snapshot) {
+                // 前回同期から変化なし
+                this.setSyncedProgress(snapshot.data, snapshot.version, now);
+                console.log('✅ 進捗データに変更なし（304）');
+                return;
+            }
             if (response.status === 401) {
                 this.showUserFriendlyError('認証エラー', 'セッションが期限切れです。再ログインしてください。', true);
                 return;
@@ -350,14 +378,14 @@ class ProgressManager {
             const data = await response.json();
 
             if (data.success) {
-                this.progressData = this.formatProgressData(data.progress);
-                
-                // キャッシュに保存
-                this.progressDataCache = this.progressData;
-                this.progressCacheExpiry = now + this.PROGRESS_CACHE_DURATION;
-                this.lastProgressLoadTime = now;
+                // 差分の場合は前回の状態に変更分を重ねる
+                const progressData = data.delta && snapshot
+                    ? this.applyProgressRecords(snapshot.data, data.progress)
+                    : this.formatProgressData(data.progress);
+                this.setSyncedProgress(progressData, data.version, now);
+                this.saveProgressSnapshot();
                 
-                console.log('✅ サーバーから進捗データ読み込み完了（キャッシュに保存）');
+                console.log(`✅ サーバーから進捗データ読み込み完了（${data.delta ? '差分' : '全件'}: ${data.progress.length}件）`);
             } else {
                 console.error('進捗データの読み込みに失敗しました:', data.error);
                 this.progressData = {};
@@ -379,7 +407,11 @@ class ProgressManager {
     // 例: [{'item_identifier': '...', 'level': '...', 'goal_index': 0, 'completed': 1}, ...]
     //  -> { 'identifier': { 'level': [true, false], ... }, ... }
     formatProgressData(records) {
-        const formatted = {};
+        return this.applyProgressRecords({}, records);
+    }
+
+    // サーバーからの進捗レコードを既存の進捗データに反映
+    applyProgressRecords(formatted, records) {
         records.forEach(record => {
             const { item_identifier, level, goal_index, completed } = record;
             if (!formatted[item_identifier]) {
@@ -401,6 +433,42 @@ class ProgressManager {
         return formatted;
     }
 
+    // 同期済みの進捗データをメモリキャッシュに設定
+    setSyncedProgress(progressData, version, now) {
+        this.progressData = progressData;
+        this.progressVersion = version;
+        this.progressDataCache = this.progressData;
+        this.progressCacheExpiry = now + this.PROGRESS_CACHE_DURATION;
+        this.lastProgressLoadTime = now;
+    }
+
+    // 前回同期した進捗データとバージョンをlocalStorageから読み込み
+    loadProgressSnapshot() {
+        try {
+            const snapshot = JSON.parse(localStorage.getItem(`progressSync_${this.userId}`));
+            if (snapshot && Number.isInteger(snapshot.version) && snapshot.data) {
+                return snapshot;
+            }
+        } catch (error) {
+            console.warn('進捗スナップショットの読み込みに失敗しました:', error);
+        }
+        return null;
+    }
+
+    // 同期済みの進捗データとバージョンをlocalStorageに保存
+    saveProgressSnapshot() {
+        if (this.progressVersion === null) return;
+        try {
+            localStorage.setItem(`progressSync_${this.userId}`, JSON.stringify({
+                version: this.progressVersion,
+                data: this.progressData
+            }));
+        } catch (error) {
+            // 容量超過等の場合は次回に全件取得する
+            console.warn('進捗スナップショットの保存に失敗しました:', error);
+        }
+    }
+
     // 【削除済み】古いupdateProgressOnServerメソッド
     // 新しいバッチ更新システムに置き換え済み
 
@@ -670,7 +738,39 @@ class ProgressManager {
     
     // --- ホームページ用の統計関数 ---
     
+    // サーバーで集計済みの進捗を取得（全体・教科ごとの完了ゴール数と達成項目数）
+    async loadProgressSummary() {
+        if (this.summaryCache) {
+            return this.summaryCache;
+        }
+        try {
+            const response = await fetch('/api/progress-summary');
+            if (!response.ok) {
+                throw new Error(`HTTP ${response.status}`);
+            }
+            const data = await response.json();
+            if (data.success) {
+                this.summaryCache = data;
+                return data;
+            }
+            console.error('進捗集計の取得に失敗しました:', data.error);
+        } catch (error) {
+            console.error('進捗集計APIの呼び出しエラー:', error);
+        }
+        return null;
+    }
+
     async getStatistics() {
+        // 未保存の変更が無ければ、サーバーで集計済みの値を使う（カタログ全体・全進捗から再計算しない）
+        if (this.pendingUpdates.size === 0 && !this.isSaving) {
+            const summary = await this.loadProgressSummary();
+            if (summary) {
+                const { totalIdentifiers, achievedIdentifiers, completedGoals, totalGoals } = summary;
+                const overallPercentage = totalIdentifiers > 0 ? Math.round((achievedIdentifiers / totalIdentifiers) * 100) : 0;
+                return { totalIdentifiers, achievedIdentifiers, completedGoals, totalGoals, overallPercentage };
+            }
+        }
+        
         console.log('🔍 [DEBUG] getStatistics開始');
         console.log('🔍 [DEBUG] this.progressData:', this.progressData);
         console.log('🔍 [DEBUG] this.userId:', this.userId);
@@ -1,20 +1,48 @@
-import pandas as pd
-import json
 import time
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash
-import os
-import google.generativeai as genai
-from datetime import datetime
-from auth import User, get_current_user, login_required
-from dotenv import load_dotenv
-from database import db_manager, initialize_database
-from psycopg.rows import dict_row
+from startup import startup_report
+
+with startup_report.step('import: stdlib'):
+    import hashlib
+    import json
+    import os
+    import threading
+    from datetime import datetime
+with startup_report.step('import: flask'):
+    from flask import Flask, Response, render_template, request, jsonify, session, redirect, url_for, flash, stream_with_context
+    from dotenv import load_dotenv
+# 依存されるモジュールを先に読み込み、各ステップにそのモジュール自身の読み込み時間だけが計上されるようにする
+with startup_report.step('import: database (psycopg)'):
+    from database import db_manager, initialize_database, get_catalog_version, bump_catalog_version, sync_learning_data
+with startup_report.step('import: auth (bcrypt, flask_login)'):
+    from auth import User, get_current_user, login_required
+with startup_report.step('import: catalog'):
+    from catalog import CATALOG_COLUMNS, load_catalog
+with startup_report.step('import: progress'):
+    from progress import fetch_progress, fetch_progress_summary, goal_bit, upsert_progress
+    from progress_writer import progress_writer, ProgressQueueFullError, PROGRESS_GROUP_COMMIT
+with startup_report.step('import: maintenance'):
+    from maintenance import start_maintenance_scheduler
+with startup_report.step('import: rate_limit'):
+    from rate_limit import rate_limited
+with startup_report.step('import: ai_executor, ai_cache'):
+    from ai_executor import ai_executor, ai_single_flight, AIBusyError, AI_TIMEOUT
+    from ai_cache import ai_response_cache, cache_ttl_for, make_cache_key
+with startup_report.step('import: ai_client'):
+    from ai_client import get_ai_backend, start_ai_warmup
+with startup_report.step('import: compression (brotli)'):
+    from compression import init_compression
+with startup_report.step('import: assets'):
+    from assets import init_assets
 
 # 環境変数を読み込み（開発環境用）
 load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-change-this-in-production')
+# HTML・JSONのgzip/brotli圧縮と事前圧縮済み静的ファイルの配信
+init_compression(app)
+# 縮小・内容ハッシュ付きの静的ファイル（テンプレートの asset_url()）と長期キャッシュ
+init_assets(app)
 
 # デバッグモードとログレベル設定
 app.config['DEBUG'] = True
@@ -62,219 +90,203 @@ def log_request_info():
 # ===== データベース初期化（新しいdatabase.pyモジュールを使用） =====
 
 
+# 起動直後のリクエストがカタログの読み込み完了を待つ最大秒数
+CATALOG_WARMUP_TIMEOUT = float(os.environ.get('CATALOG_WARMUP_TIMEOUT', '15'))
+
 class StudyDataViewer:
     def __init__(self):
-        self.data = None
+        self.catalog = None  # 学習項目カタログ（catalog.Catalog、更新時は丸ごと差し替え）
         self._cached_stats = None  # 統計情報のキャッシュ
-        self._content_cache = {}  # コンテンツ詳細のキャッシュ
-        self._subject_cache = {}  # 教科別データのキャッシュ
-        self._cache_timestamp = None  # キャッシュタイムスタンプ
-        self.CACHE_DURATION = 300  # 5分キャッシュ
-        self.load_data()
+        self._refresh_lock = threading.Lock()
+        self._ready = threading.Event()  # 初回読み込み（成功・失敗とも）完了
 
     def load_data(self):
-        """PostgreSQLデータベースからデータを読み込み、identifierで昇順にソートして格納"""
+        """学習データのカタログを読み込み（共有スナップショットをmmap、無い・古ければDBから構築）"""
         try:
-            # psycopg v3対応のデータベース操作
-            with db_manager.get_connection() as conn:
-                # 必要な列のみを選択してクエリを最適化
-                optimized_query = """
-                    SELECT identifier, learning_prompt, keywords, grade, subject, 
-                           learning_objective, difficulty, content_types 
-                    FROM learning_items 
-                    ORDER BY identifier ASC
-                """
-                self.data = pd.read_sql_query(optimized_query, conn)
+            # DBに接続できない場合は既存のスナップショットをそのまま使う
+            try:
+                source_version = self._fetch_version()
+            except Exception as e:
+                print(f"[WARNING] カタログバージョン取得エラー: {e}")
+                source_version = None
             
-            print(f"データベースからデータを正常に読み込みました。行数: {len(self.data)}")
+            self._set_catalog(load_catalog(self._fetch_rows, source_version=source_version))
             
             # デバッグ: 教科リストを出力
-            if self.data is not None and not self.data.empty:
-                subjects = self.data['subject'].unique()
-                print(f"[DEBUG] 読み込まれた教科: {list(subjects)}")
-            
-            # データ読み込み時に統計情報もキャッシュ
-            self._calculate_stats_cache()
+            print(f"[DEBUG] 読み込まれた教科: {self.catalog.subjects}")
         except Exception as e:
             print(f"データベース読み込みエラー: {e}")
-            self.data = None
+            self.catalog = None
             self._cached_stats = None
     
-    def _calculate_stats_cache(self):
-        """統計情報を計算してキャッシュに保存（起動時の1回のみ実行）"""
-        if self.data is None:
-            self._cached_stats = None
-            return
-        
-        try:
-            total_identifiers = len(self.data)
-            total_goals = 0
-            error_count = 0
+    def refresh(self):
+        """DBのカタログバージョンが変わっていれば、新しいカタログを構築して差し替え"""
+        with self._refresh_lock:
+            source_version = self._fetch_version()
+            current = self.catalog
+            if current is not None and current.source_version == source_version:
+                if current.stale:
+                    # DBに接続できなかった間に使っていたスナップショットが最新であることを確認できた
+                    current.stale = False
+                    print(f"[CATALOG] INFO: スナップショットがDBのカタログと一致することを確認しました (source version {source_version})")
+                return False
             
-            print(f"[STARTUP] 統計情報キャッシュを計算中... ({total_identifiers}項目)")
+            # 構築が終わるまでは古いカタログで応答を続ける
+            self._set_catalog(load_catalog(self._fetch_rows, source_version=source_version))
+            return True
+    
+    def start(self, refresh_interval):
+        """バックグラウンドでカタログを読み込み、その後はバージョンを定期的に確認"""
+        def run():
+            try:
+                with startup_report.step('catalog warm-up'):
+                    self.load_data()
+            finally:
+                self._ready.set()
+            startup_report.print_report('Catalog ready')
             
-            # 各項目のゴール数を計算
-            for _, row in self.data.iterrows():
+            while True:
+                time.sleep(refresh_interval)
                 try:
-                    content_data = json.loads(row['content_types'])  # 正しいカラム名
-                    progress_tracking = content_data.get('progressTracking', {})
-                    
-                    beginner_goals = len(progress_tracking.get('beginnerGoals', []))
-                    intermediate_goals = len(progress_tracking.get('intermediateGoals', []))
-                    advanced_goals = len(progress_tracking.get('advancedGoals', []))
-                    
-                    total_goals += beginner_goals + intermediate_goals + advanced_goals
-                    
-                except (json.JSONDecodeError, KeyError) as e:
-                    error_count += 1
-                    if error_count <= 3:  # 最初の3件のみログ出力
-                        print(f"[STARTUP] データ解析エラー (ID: {row.get('identifier', 'unknown')}): {e}")
-                    continue
-            
-            self._cached_stats = {
-                'totalIdentifiers': total_identifiers,
-                'totalGoals': total_goals,
-                'errorCount': error_count
-            }
-            print(f"[STARTUP] 統計キャッシュ完了: {total_identifiers}項目, {total_goals}ゴール (エラー: {error_count}件)")
-            
-        except Exception as e:
-            print(f"[STARTUP] 統計計算エラー: {e}")
-            self._cached_stats = None
+                    if self.refresh():
+                        print(f"[CATALOG] INFO: カタログを差し替えました (source version {self.catalog.source_version})")
+                except Exception as e:
+                    print(f"[CATALOG] ERROR: カタログ更新確認エラー: {e}")
+        
+        thread = threading.Thread(target=run, name='catalog-loader', daemon=True)
+        thread.start()
+        return thread
+    
+    def _set_catalog(self, catalog):
+        """カタログと統計キャッシュを差し替え（参照の代入のみなので読み取り側はロック不要）"""
+        self.catalog = catalog
+        self._cached_stats = catalog.stats
+        print(f"学習データを正常に読み込みました。行数: {len(catalog)} (バージョン: {catalog.version})")
+        print(f"[STARTUP] 統計キャッシュ完了: {catalog.stats['totalIdentifiers']}項目, "
+              f"{catalog.stats['totalGoals']}ゴール (エラー: {catalog.stats['errorCount']}件)")
+    
+    def _fetch_version(self):
+        """DBのカタログバージョンを取得"""
+        with db_manager.get_connection() as conn:
+            with conn.cursor() as cur:
+                return get_catalog_version(cur)
+    
+    def _fetch_rows(self):
+        """PostgreSQLからカタログバージョンとidentifier昇順の学習項目を読み込み"""
+        # psycopg v3対応のデータベース操作
+        with db_manager.get_connection() as conn:
+            with conn.cursor() as cur:
+                # バージョンと行を同じスナップショットから読む
+                cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                source_version = get_catalog_version(cur)
+                # 必要な列のみを選択してクエリを最適化
+                cur.execute(f"""
+                    SELECT {', '.join(CATALOG_COLUMNS)}
+                    FROM learning_items 
+                    ORDER BY identifier ASC
+                """)
+                return source_version, cur.fetchall()
+    
+    def get_catalog(self):
+        """現在のカタログを取得（起動直後は読み込み完了を一定時間待つ）"""
+        if not self._ready.is_set():
+            self._ready.wait(CATALOG_WARMUP_TIMEOUT)
+        return self.catalog
     
     def get_identifiers(self):
         """利用可能な識別子のリストを取得"""
-        if self.data is not None:
-            return self.data['identifier'].tolist()
+        catalog = self.get_catalog()
+        if catalog is not None:
+            return list(catalog.identifiers)
         return []
     
     def get_all_content_with_subjects(self):
-        """全てのコンテンツを教科ごとに分類して取得（identifier順でキャッシュ付き）"""
-        if self.data is None:
+        """全てのコンテンツを教科ごとに分類して取得（identifier順、カタログ単位でキャッシュ）"""
+        catalog = self.get_catalog()
+        if catalog is None:
             return {}
-        
-        # キャッシュチェック
-        now = time.time()
-        if (self._subject_cache and self._cache_timestamp and 
-            (now - self._cache_timestamp) < self.CACHE_DURATION):
-            return self._subject_cache
-        
-        content_by_subject = {}
-        # self.dataは既にidentifierでソート済み
-        # groupbyのsort=Falseで、元のデータフレームの順序を維持したままグループ化
-        for subject, group in self.data.groupby('subject', sort=False):
-            items = group.to_dict('records')
-            # キーワードと合計ゴール数を計算して追加
-            for item in items:
-                # NaN値を適切にハンドリング
-                for key, value in item.items():
-                    if pd.isna(value):
-                        if key == 'grade':
-                            item[key] = 0  # gradeのNaNは0に変換
-                        else:
-                            item[key] = None  # その他のNaNはNoneに変換
-                
-                item['keywords'] = json.loads(item['keywords'])
-                try:
-                    content_data = json.loads(item['content_types'])
-                    progress_tracking = content_data.get('progressTracking', {})
-                    beginner_goals = len(progress_tracking.get('beginnerGoals', []))
-                    intermediate_goals = len(progress_tracking.get('intermediateGoals', []))
-                    advanced_goals = len(progress_tracking.get('advancedGoals', []))
-                    item['total_goals'] = beginner_goals + intermediate_goals + advanced_goals
-                except (json.JSONDecodeError, KeyError):
-                    item['total_goals'] = 0 # パース失敗時は0
-            content_by_subject[subject] = items
-        
-        # identifier順で並び替えるため、教科順序を取得
-        subject_order = self.get_subjects()
-        
-        # 順序通りに並び替えた辞書を作成
-        ordered_content = {}
-        for subject in subject_order:
-            if subject in content_by_subject:
-                ordered_content[subject] = content_by_subject[subject]
-        
-        # キャッシュに保存
-        self._subject_cache = ordered_content
-        self._cache_timestamp = now
-                
-        return ordered_content
+        return catalog.summary_by_subject()
     
     def get_subjects(self):
         """利用可能な教科のリストを取得（identifier順で取得）"""
-        try:
-            with db_manager.get_connection() as conn:
-                with conn.cursor() as cur:
-                    # identifier順（学習指導要領の順序）で教科を取得
-                    cur.execute("""
-                        SELECT subject, MIN(identifier) as first_identifier
-                        FROM learning_items 
-                        GROUP BY subject 
-                        ORDER BY MIN(identifier) ASC
-                    """)
-                    subjects = [row[0] for row in cur.fetchall()]
-                    return subjects
-        except Exception as e:
-            print(f"[ERROR] 教科リスト取得エラー: {e}")
-            # フォールバック: identifier順の固定リスト
-            return ['国語', '社会', '数学', '理科', '音楽', '英語', '技術・家庭', '保健体育', '美術', '道徳']
+        catalog = self.get_catalog()
+        if catalog is not None and catalog.subjects:
+            return catalog.subjects
+        # フォールバック: identifier順の固定リスト
+        return ['国語', '社会', '数学', '理科', '音楽', '英語', '技術・家庭', '保健体育', '美術', '道徳']
     
-    def get_content_by_id(self, identifier):
-        """指定された識別子の内容を取得（キャッシュ付き）"""
-        if self.data is None:
+    def get_item(self, identifier):
+        """指定された識別子のレコードを取得（ハッシュインデックス参照）"""
+        catalog = self.get_catalog()
+        if catalog is None:
             return None
-        
-        # キャッシュチェック
-        if identifier in self._content_cache:
-            return self._content_cache[identifier]
-        
-        # 識別子で行を検索
-        row = self.data[self.data['identifier'] == identifier]
-        
-        if row.empty:
+        return catalog.get(identifier)
+    
+    def get_prompt_context(self, identifier):
+        """AIプロンプト用の学習内容の文章を取得（戻り値: (カタログのバージョン, 文章)、見つからない場合は (None, None)）"""
+        catalog = self.get_catalog()
+        if catalog is None or not identifier:
+            return None, None
+        context_text = catalog.prompt_context(identifier)
+        if context_text is None:
+            return None, None
+        return catalog.version, context_text
+    
+    def get_content_by_id(self, identifier):
+        """指定された識別子の内容を取得"""
+        item = self.get_item(identifier)
+        if item is None:
             return None
-        
-        try:
-            # 変更後: DataFrameから直接データを取得し、必要なJSONをパース
-            row_data = row.iloc[0]
-            
-            # NaN値を適切にハンドリング
-            grade = row_data['grade']
-            if pd.isna(grade):
-                grade = 0
-            
-            learning_prompt_data = {
-                'learningPrompt': row_data['learning_prompt'],
-                'keywords': json.loads(row_data['keywords']),
-                'grade': grade,
-                'subject': row_data['subject'],
-                'learningObjective': row_data['learning_objective'],
-                'difficulty': row_data['difficulty']
-            }
-            content_creation_prompt = json.loads(row_data['content_types'])
-            
-            result = {
-                'identifier': identifier,
-                'learningPromptData': learning_prompt_data,
-                'contentCreationPrompt': content_creation_prompt
-            }
-            
-            # キャッシュに保存
-            self._content_cache[identifier] = result
-            return result
-            
-        except (json.JSONDecodeError, KeyError) as e:
-            print(f"データ解析エラー (ID: {identifier}): {e}")
+        content = item.to_content()
+        if content['contentCreationPrompt'] is None:
             return None
+        return content
 
-# PostgreSQLデータベースを初期化
-print("[STARTUP] INFO: Initializing PostgreSQL database...")
-initialize_database()
+# スキーマ作成はデプロイ時の init_database.py で行う（INIT_DB_ON_STARTUP=1 で従来どおり起動時に実行）
+if os.environ.get('INIT_DB_ON_STARTUP') == '1':
+    print("[STARTUP] INFO: Initializing PostgreSQL database...")
+    with startup_report.step('initialize_database'):
+        initialize_database()
 
 # グローバルインスタンス
 viewer = StudyDataViewer()
 
+# カタログはバックグラウンドで読み込み、以降は他のワーカー・スクリプトによる更新を検知して差し替え
+viewer.start(int(os.environ.get('CATALOG_POLL_INTERVAL', '30')))
+
+# プレミアム期限切れ・月次利用回数リセットの定期メンテナンス（0で無効）
+MAINTENANCE_INTERVAL = int(os.environ.get('MAINTENANCE_INTERVAL', '300'))
+if MAINTENANCE_INTERVAL > 0:
+    start_maintenance_scheduler(MAINTENANCE_INTERVAL)
+
+# AIクライアントの作成・接続をバックグラウンドで済ませ、初回のAI生成を待たせない
+start_ai_warmup()
+
+# メインページの描画結果キャッシュ（カタログのバージョン → (ETag, HTML)）
+# ページ内容はカタログのみに依存するため、カタログが変わるまで再描画しない
+_index_page_cache = {}
+
+def _render_index_page():
+    """メインページを描画（カタログのバージョン単位でキャッシュ）"""
+    catalog = viewer.get_catalog()
+    version = catalog.version if catalog is not None else None
+    
+    cached = _index_page_cache.get(version) if version else None
+    if cached:
+        return cached
+    
+    # 描画中にカタログが差し替わってもバージョンと内容がずれないよう、同じカタログから取得
+    content_by_subject = catalog.summary_by_subject() if catalog is not None else {}
+    subjects = catalog.subjects if catalog is not None and catalog.subjects else viewer.get_subjects()
+    body = render_template('index.html', content_by_subject=content_by_subject, subjects=subjects)
+    etag = hashlib.sha256(body.encode('utf-8')).hexdigest()[:32]
+    
+    if version:
+        # 古いバージョンの描画結果は破棄して最新の1件だけ保持
+        _index_page_cache.clear()
+        _index_page_cache[version] = (etag, body)
+    return etag, body
+
 @app.route('/')
 def index():
     """メインページ"""
@@ -284,9 +296,12 @@ def index():
     if not user:
         return redirect(url_for('login'))
     
-    content_by_subject = viewer.get_all_content_with_subjects()
-    subjects = viewer.get_subjects()
-    return render_template('index.html', content_by_subject=content_by_subject, subjects=subjects)
+    etag, body = _render_index_page()
+    response = app.make_response(body)
+    # 強いETagを付与し、If-None-Matchが一致すれば304を返す
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
 
 @app.route('/api/content/<identifier>')
 def get_content(identifier):
@@ -299,27 +314,15 @@ def get_content(identifier):
 
 @app.route('/api/learning-item/<identifier>')
 def get_learning_item(identifier):
-    """API: 指定されたIDの学習項目情報（教科名等）を取得"""
-    try:
-        with db_manager.get_connection() as conn:
-            with conn.cursor(row_factory=dict_row) as cur:
-                cur.execute(
-                    "SELECT identifier, subject FROM learning_items WHERE identifier = %s",
-                    (identifier,)
-                )
-                item = cur.fetchone()
-                
-                if item:
-                    return jsonify({
-                        'identifier': item['identifier'],
-                        'subject': item['subject']
-                    })
-                else:
-                    return jsonify({'error': 'Learning item not found'}), 404
-                    
-    except Exception as e:
-        print(f"[ERROR] 学習項目取得エラー: {e}")
-        return jsonify({'error': 'Database error'}), 500
+    """API: 指定されたIDの学習項目情報（教科名等）を取得（カタログから取得、DBアクセスなし）"""
+    item = viewer.get_item(identifier)
+    if item:
+        return jsonify({
+            'identifier': item.identifier,
+            'subject': item.subject
+        })
+    else:
+        return jsonify({'error': 'Learning item not found'}), 404
 
 @app.route('/api/subjects')
 def get_subjects_api():
@@ -342,6 +345,7 @@ def view_content(identifier):
         return "コンテンツが見つかりません", 404
 
 @app.route('/api/test-api-key', methods=['POST'])
+@rate_limited('test_api_key')
 def test_api_key():
     """APIキーの有効性をテスト"""
     try:
@@ -351,18 +355,21 @@ def test_api_key():
         if not api_key:
             return jsonify({'success': False, 'error': 'APIキーが設定されていません'}), 400
         
-        # Gemini APIキーをテスト
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        
-        # 簡単なテストプロンプト
-        response = model.generate_content("Hello")
+        # Gemini APIキーをテスト（共有クライアントの設定は変更しない、AI実行プールで実行）
+        backend = get_ai_backend()
+        if backend is None:
+            return jsonify({'success': False, 'error': 'サーバーのAI機能が無効です'}), 500
+        valid = ai_executor.run(backend.check_api_key, api_key, timeout=AI_TIMEOUT)
         
-        if response and response.text:
+        if valid:
             return jsonify({'success': True, 'message': 'APIキーは有効です'})
         else:
             return jsonify({'success': False, 'error': 'APIからの応答が無効です'}), 400
-            
+    
+    except AIBusyError:
+        return _ai_busy_response()
+    except TimeoutError:
+        return _ai_timeout_response()
     except Exception as e:
         error_message = str(e)
         print(f"API Test Error: {error_message}")  # デバッグ用
@@ -378,47 +385,136 @@ def test_api_key():
 
 @app.route('/api/progress-stats', methods=['GET'])
 def get_progress_stats():
-    """全ての学習項目の進捗統計情報を取得（キャッシュ使用）"""
+    """全ての学習項目の統計情報（項目数・ゴール数）を取得
+
+    カタログ読み込み時に計算済みの値とカタログのバージョンのみを返す（カタログ本体は /api/catalog）。
+    ETagはカタログのバージョンから作るため、カタログが変わるまでは304を返す。
+    catalogStaleは、DBに接続できずに照合していないスナップショットを使っている場合にTrue
+    """
     try:
-        # 教科別データを取得
-        items_by_subject = viewer.get_all_content_with_subjects()
+        catalog = viewer.get_catalog()
+        if catalog is None:
+            return jsonify({'success': False, 'error': 'データが読み込まれていません'}), 500
         
-        # キャッシュが存在する場合はそれを返す
-        if viewer._cached_stats:
-            return jsonify({
+        etag = f"stats-{catalog.version}{'-stale' if catalog.stale else ''}"
+        if request.if_none_match.contains_weak(etag):
+            response = app.make_response(('', 304))
+        else:
+            response = jsonify({
                 'success': True,
-                'totalIdentifiers': viewer._cached_stats['totalIdentifiers'],
-                'totalGoals': viewer._cached_stats['totalGoals'],
-                'items_by_subject': items_by_subject,
-                'cached': True  # キャッシュ使用であることを示す
+                'catalogVersion': catalog.version,
+                'catalogStale': catalog.stale,
+                'totalIdentifiers': catalog.stats['totalIdentifiers'],
+                'totalGoals': catalog.stats['totalGoals'],
+                'cached': True  # 計算済みの値であることを示す
             })
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'public, no-cache'
+        return response
         
-        # キャッシュが無い場合（エラー時のフォールバック）
-        if viewer.data is None:
+    except Exception as e:
+        print(f"進捗統計取得エラー: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+# カタログ一覧のJSONキャッシュ（カタログのバージョン → JSON文字列）
+_catalog_payload_cache = {}
+
+@app.route('/api/catalog', methods=['GET'])
+def get_catalog_payload():
+    """教科ごとの学習項目一覧（カタログ本体）を取得
+
+    内容はカタログのみに依存するため、JSONはバージョンごとに1回だけ作成し、ETagで304を返す
+    """
+    catalog = viewer.get_catalog()
+    if catalog is None:
+        return jsonify({'success': False, 'error': 'データが読み込まれていません'}), 500
+    
+    etag = f"catalog-{catalog.version}"
+    if request.if_none_match.contains_weak(etag):
+        response = app.make_response(('', 304))
+    else:
+        payload = _catalog_payload_cache.get(catalog.version)
+        if payload is None:
+            payload = json.dumps({
+                'success': True,
+                'catalogVersion': catalog.version,
+                'items_by_subject': catalog.summary_by_subject()
+            }, ensure_ascii=False)
+            # 古いバージョンのJSONは破棄して最新の1件だけ保持
+            _catalog_payload_cache.clear()
+            _catalog_payload_cache[catalog.version] = payload
+        response = app.response_class(payload, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'public, no-cache'
+    return response
+
+
+@app.route('/api/progress-summary', methods=['GET'])
+def get_progress_summary():
+    """ログイン中のユーザーの進捗集計（全体・教科ごとの完了ゴール数と達成項目数）を取得
+
+    ホーム画面の統計用。カタログ全体や進捗の全行を送らずに、集計済みの値だけを返す
+    """
+    user_id = session.get('user_id')
+    if user_id is None:
+        return jsonify({'success': False, 'error': 'ログインが必要です'}), 401
+    try:
+        catalog = viewer.get_catalog()
+        if catalog is None:
             return jsonify({'success': False, 'error': 'データが読み込まれていません'}), 500
-        
-        print("[WARNING] 統計キャッシュが無いため、フォールバック処理を実行")
-        return jsonify({
+        version, subjects = fetch_progress_summary(user_id, catalog)
+        subject_summaries = []
+        for subject in catalog.subjects:
+            completed_goals, achieved_items = subjects.get(subject, (0, 0))
+            subject_summaries.append({
+                'subject': subject,
+                'totalItems': len(catalog.items_by_subject[subject]),
+                'completedGoals': completed_goals,
+                'achievedItems': achieved_items
+            })
+        response = jsonify({
             'success': True,
-            'totalIdentifiers': len(viewer.data),
-            'totalGoals': 0,  # フォールバック時は簡易計算
-            'items_by_subject': items_by_subject,
-            'cached': False
+            'version': version,
+            'catalogVersion': catalog.version,
+            'totalIdentifiers': catalog.stats['totalIdentifiers'],
+            'totalGoals': catalog.stats['totalGoals'],
+            'completedGoals': sum(summary['completedGoals'] for summary in subject_summaries),
+            'achievedIdentifiers': sum(summary['achievedItems'] for summary in subject_summaries),
+            'subjects': subject_summaries
         })
+        # 進捗バージョンとカタログが同じなら集計も同じ
+        response.set_etag(f"summary-{user_id}-{version}-{catalog.version}")
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response.make_conditional(request)
         
     except Exception as e:
-        print(f"進捗統計取得エラー: {e}")
+        print(f"進捗集計取得エラー: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
 @app.route('/api/progress/<user_id>', methods=['GET'])
 def get_progress(user_id):
-    """指定されたユーザーの進捗データを取得"""
+    """指定されたユーザーの進捗データを取得
+
+    ?since=<version> を付けると、そのバージョン以降に変わった行だけを返す（変化が無ければ空の差分）。
+    ETagで条件付きリクエストに対応する（If-None-Matchが一致する場合のみ304）
+    """
     try:
-        progress_data = db_manager.execute_query("SELECT * FROM progress WHERE user_id = %s", (user_id,))
-        
-        # psycopg v3では辞書型として返される
-        return jsonify({'success': True, 'progress': progress_data})
+        since = request.args.get('since', type=int)
+        version, progress_data = fetch_progress(user_id, since)
+        delta = since is not None and since <= version
+        response = jsonify({
+            'success': True,
+            'progress': progress_data,
+            'version': version,
+            'delta': delta
+        })
+        # 同じバージョン・同じ差分の起点なら内容は同じ
+        response.set_etag(f"progress-{user_id}-{since if delta else 'all'}-{version}")
+        response = response.make_conditional(request)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
         
     except Exception as e:
         print(f"進捗データ取得エラー: {e}")
@@ -441,33 +537,38 @@ def update_progress():
         if not all([user_id, item_identifier, level, goal_index is not None, completed is not None]):
             print(f"[DEBUG] Parameter validation failed for: {data}") # デバッグログ
             return jsonify({'success': False, 'error': '必要なパラメータが不足しています'}), 400
+        if goal_bit(level, goal_index) is None:
+            return jsonify({'success': False, 'error': 'レベルまたはゴール番号が不正です'}), 400
 
-        # PostgreSQL用UPSERT構文
-        sql = """
-            INSERT INTO progress (user_id, item_identifier, level, goal_index, completed, updated_at)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            ON CONFLICT (user_id, item_identifier, level, goal_index) 
-            DO UPDATE SET completed = EXCLUDED.completed, updated_at = EXCLUDED.updated_at
-        """
-        params = (user_id, item_identifier, level, goal_index, completed, datetime.now())
-        
-        print(f"[DEBUG] Executing SQL: {sql} with params {params}") # デバッグログ
-        
-        # psycopg v3対応のデータベース操作（トランザクション保護付き）
-        with db_manager.get_connection() as conn:
-            try:
-                with conn.cursor() as cursor:
-                    cursor.execute(sql, params)
-                    conn.commit()
-                    print("[DEBUG] Individual progress update committed")
-            except Exception as e:
-                conn.rollback()
-                print(f"[ERROR] Individual update transaction rolled back: {e}")
-                raise
+        rows = [(item_identifier, level, goal_index, completed)]
+        if PROGRESS_GROUP_COMMIT:
+            # 他のリクエストの書き込みとまとめてコミット（コミット完了を待ってから応答）
+            version = progress_writer.write(user_id, rows, viewer.catalog)
+        else:
+            # psycopg v3対応のデータベース操作（トランザクション保護付き、進捗バージョンも同じトランザクションで更新）
+            with db_manager.get_connection() as conn:
+                try:
+                    with conn.cursor() as cursor:
+                        version = upsert_progress(cursor, user_id, rows, datetime.now(), viewer.catalog)
+                        conn.commit()
+                        print("[DEBUG] Individual progress update committed")
+                except Exception as e:
+                    conn.rollback()
+                    print(f"[ERROR] Individual update transaction rolled back: {e}")
+                    raise
 
         print("[DEBUG] Progress update successful.") # デバッグログ
-        return jsonify({'success': True, 'message': '進捗を更新しました'})
+        return jsonify({'success': True, 'message': '進捗を更新しました', 'version': version})
 
+    except (ProgressQueueFullError, TimeoutError):
+        # 書き込みキューが満杯・コミット待ちが長すぎる場合は、DBに負荷をかけずに再送を促す
+        response = jsonify({
+            'success': False,
+            'code': 'PROGRESS_BUSY',
+            'error': '進捗の保存が混み合っています。少し時間をおいてから再度お試しください。'
+        })
+        response.headers['Retry-After'] = '1'
+        return response, 503
     except Exception as e:
         import traceback
         print(f"[ERROR] Progress update failed: {e}")
@@ -477,9 +578,13 @@ def update_progress():
 
 @app.route('/api/progress/batch-update', methods=['POST'])
 def batch_update_progress():
-    """進捗データをバッチで更新（パフォーマンス最適化）"""
+    """進捗データをバッチで更新（パフォーマンス最適化）
+
+    同じゴールへの複数の変更は最後の値にまとめ、全件を1つのUPSERT文で書き込む
+    """
     try:
-        data = request.get_json()
+        # ページ離脱時のsendBeaconはContent-Typeがtext/plainのため、形式に関わらずJSONとして読む
+        data = request.get_json(force=True, silent=True) or {}
         print(f"[DEBUG] /api/progress/batch-update received: {len(data.get('updates', []))} updates") # デバッグログ
 
         user_id = data.get('userId')
@@ -488,16 +593,7 @@ def batch_update_progress():
         if not user_id or not updates:
             return jsonify({'success': False, 'error': '必要なパラメータが不足しています'}), 400
 
-        # バッチ処理用のSQL（PostgreSQL UPSERT）
-        sql = """
-            INSERT INTO progress (user_id, item_identifier, level, goal_index, completed, updated_at)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            ON CONFLICT (user_id, item_identifier, level, goal_index) 
-            DO UPDATE SET completed = EXCLUDED.completed, updated_at = EXCLUDED.updated_at
-        """
-        
         # バッチパラメータ準備
-        current_time = datetime.now()
         batch_params = []
         
         for update in updates:
@@ -506,11 +602,11 @@ def batch_update_progress():
             goal_index = update.get('goalIndex')
             completed = update.get('completed')
             
-            if not all([item_identifier, level, goal_index is not None, completed is not None]):
+            if not all([item_identifier, level, goal_index is not None, completed is not None]) or goal_bit(level, goal_index) is None:
                 print(f"[WARNING] Skipping invalid update: {update}")
                 continue
                 
-            batch_params.append((user_id, item_identifier, level, goal_index, completed, current_time))
+            batch_params.append((item_identifier, level, goal_index, completed))
         
         if not batch_params:
             return jsonify({'success': False, 'error': '有効な更新データがありません'}), 400
@@ -521,7 +617,7 @@ def batch_update_progress():
         with db_manager.get_connection() as conn:
             try:
                 with conn.cursor() as cursor:
-                    cursor.executemany(sql, batch_params)
+                    version = upsert_progress(cursor, user_id, batch_params, datetime.now(), viewer.catalog)
                     conn.commit()
                     print(f"[DEBUG] Transaction committed: {len(batch_params)} records")
             except Exception as e:
@@ -533,7 +629,8 @@ def batch_update_progress():
         return jsonify({
             'success': True, 
             'message': f'{len(batch_params)}件の進捗を更新しました',
-            'updated_count': len(batch_params)
+            'updated_count': len(batch_params),
+            'version': version
         })
 
     except Exception as e:
@@ -562,6 +659,23 @@ def debug_session():
         print(f"[DEBUG] Error in debug_session: {e}")  # コンソールログ
         return jsonify({'error': str(e)})
 
+@app.route('/api/debug/startup', methods=['GET'])
+def debug_startup():
+    """起動時間の内訳（import・初期化・カタログ読み込み）"""
+    return jsonify(startup_report.as_dict())
+
+@app.route('/api/debug/ai-cache', methods=['GET'])
+def debug_ai_cache():
+    """AI生成結果キャッシュ・同時リクエスト合流の利用状況（ヒット率等）"""
+    stats = ai_response_cache.stats()
+    stats['singleFlight'] = ai_single_flight.stats()
+    return jsonify(stats)
+
+@app.route('/api/debug/progress-writer', methods=['GET'])
+def debug_progress_writer():
+    """進捗書き込みキュー（グループコミット）の利用状況"""
+    return jsonify(progress_writer.stats())
+
 @app.route('/api/test-log', methods=['GET'])
 def test_log():
     """ログテスト用"""
@@ -572,6 +686,7 @@ def test_log():
     return jsonify({'message': 'Check console for log message', 'timestamp': datetime.now().isoformat()})
 
 @app.route('/api/ai-generate-test', methods=['POST'])
+@rate_limited('ai')
 def ai_generate_test():
     """AI APIテスト版（認証なし・デバッグ用）"""
     print(f"[DEBUG] AI TEST API called - Request data: {request.get_json()}")
@@ -580,35 +695,179 @@ def ai_generate_test():
         prompt = data.get('prompt', 'テストプロンプト')
         
         # APIキー確認
-        if not GEMINI_API_KEY:
+        backend = get_ai_backend()
+        if backend is None:
             print("[ERROR] GEMINI_API_KEY is not set")
             return jsonify({'success': False, 'error': 'APIキーが設定されていません'}), 500
         
         # Gemini API実行
-        genai.configure(api_key=GEMINI_API_KEY)
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        response = model.generate_content(prompt)
+        text = ai_executor.run(backend.generate, prompt, timeout=AI_TIMEOUT)
         
-        if response and response.text:
+        if text:
             return jsonify({
                 'success': True,
-                'result': response.text,
+                'result': text,
                 'debug': 'Test API successful'
             })
         else:
             return jsonify({'success': False, 'error': 'Empty response'}), 500
-            
+    
+    except AIBusyError:
+        return _ai_busy_response()
+    except TimeoutError:
+        return _ai_timeout_response()
     except Exception as e:
         print(f"[ERROR] AI Test Error: {e}")
         import traceback
         traceback.print_exc()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# 基本的な優しいトーンの設定
+AI_BASE_TONE = """あなたは不登校の子どもたちをサポートする優しい教育アシスタントです。
+常に温かく、理解のある態度で接し、プレッシャーを与えずに学習をサポートしてください。
+子どもたちのペースを尊重し、小さな進歩も褒めて励ましてください。"""
+
+AI_UPGRADE_URL = 'https://www.smilefactory-rakuai.com/product-page/%E5%AD%A6%E7%BF%92%E6%8C%87%E5%B0%8E%E8%A6%81%E9%A0%98%E6%BA%96%E6%8B%A0-ai%E5%AD%A6%E7%BF%92%E3%82%A2%E3%83%97%E3%83%AA'
+
+# AIアシスタント（チャット）のコンテンツタイプ
+AI_CHAT_CONTENT_TYPE = 'Learning Assistant'
+
+# プロンプト末尾の指示文（学習内容の文章はカタログ側で項目ごとに作成済み）
+AI_CONTENT_INSTRUCTIONS = """上記の学習内容とゴールを理解した上で、以下の観点から優しくアドバイスを提供してください：
+1. この学習内容に特化した具体的なアプローチ
+2. 必要な材料やツール（家庭にあるものを中心に）
+3. 無理をしないで進めるコツ
+4. 小さな達成感を味わえる工夫
+5. 学年に適した楽しい要素
+
+あなたならきっとできます！一歩ずつ、自分のペースで進めていきましょう。"""
+
+AI_HOME_INSTRUCTIONS = """あなたは学習について相談された優しい先生です。以下の点を心がけて回答してください：
+1. 無理をしないことの大切さを伝える
+2. 小さな一歩でも価値があることを伝える
+3. 具体的で実践しやすいアドバイス
+4. 励ましの言葉を忘れずに
+
+学習は競争ではありません。あなた自身のペースで、興味のあることから始めてみましょう。"""
+
+AI_CHAT_INSTRUCTIONS = """以下の点を意識して回答してください：
+- 短く、分かりやすい説明（200文字程度）
+- マークダウン記法は使わない（普通の文章で）
+- 温かく励ましの気持ちを込める
+- プレッシャーを与えない表現
+- 具体的で実践しやすいアドバイス
+
+簡潔で読みやすい文章で答えてください。"""
+
+# クライアントから受け付けるプロンプトの最大文字数
+AI_MAX_PROMPT_LENGTH = int(os.environ.get('AI_MAX_PROMPT_LENGTH', '4000'))
+
+def _build_enhanced_prompt(prompt, content_type, context_text):
+    """AIに送るプロンプトを構築
+
+    context_text はカタログから取得した学習内容の文章（学習項目に紐づかない場合はNone）
+    """
+    if content_type == AI_CHAT_CONTENT_TYPE:
+        # AIアシスタントのチャット（短い回答）
+        parts = [AI_BASE_TONE, context_text, f"ユーザーからの質問: {prompt}", AI_CHAT_INSTRUCTIONS]
+    elif context_text:
+        # content画面のテンプレートプロンプト
+        parts = [AI_BASE_TONE, context_text, f"コンテンツタイプ: {content_type}", prompt, AI_CONTENT_INSTRUCTIONS]
+    else:
+        # ホーム画面用（汎用的な優しいメッセージ）
+        parts = [AI_BASE_TONE, prompt, AI_HOME_INSTRUCTIONS]
+    return '\n\n'.join(part for part in parts if part)
+
+def _parse_ai_request(data):
+    """AI生成リクエストの本文を解析（戻り値: (リクエスト内容の辞書, エラーレスポンス)）
+
+    学習内容はクライアントから受け取らず、identifierからカタログを引いてサーバー側で組み立てる
+    """
+    prompt = (data.get('prompt') or '').strip()
+    if not prompt:
+        return None, (jsonify({'success': False, 'error': 'プロンプトが提供されていません'}), 400)
+    if len(prompt) > AI_MAX_PROMPT_LENGTH:
+        return None, (jsonify({'success': False, 'error': f'プロンプトが長すぎます（{AI_MAX_PROMPT_LENGTH}文字まで）'}), 400)
+    
+    # 旧バージョンのクライアントは context.identifier で送る
+    identifier = data.get('identifier') or (data.get('context') or {}).get('identifier')
+    catalog_version, context_text = viewer.get_prompt_context(identifier)
+    return {
+        'prompt': prompt,
+        'content_type': data.get('content_type', ''),
+        'identifier': identifier if context_text is not None else None,
+        'catalog_version': catalog_version,
+        'context_text': context_text
+    }, None
+
+def _ai_request_fingerprint(ai_request, backend):
+    """キャッシュ・同時リクエスト合流に使うプロンプトの指紋"""
+    return make_cache_key(ai_request['prompt'], ai_request['content_type'], ai_request['identifier'],
+                          ai_request['catalog_version'], backend.model_name)
+
+def _usage_limit_response(user):
+    """利用制限超過時のレスポンス"""
+    return jsonify({
+        'success': False,
+        'error': 'USAGE_LIMIT_EXCEEDED',
+        'message': f'無料利用回数（30回/月）を超過しました。現在の利用回数: {user.free_usage_count}/30',
+        'upgrade_url': AI_UPGRADE_URL
+    }), 429
+
+def _ai_busy_response():
+    """AI実行プールが満杯の場合のレスポンス（Gemini呼び出し前に即座に返す）"""
+    response = jsonify({
+        'success': False,
+        'code': 'AI_BUSY',
+        'error': 'AIが混み合っています。少し時間をおいてから再度お試しください。'
+    })
+    response.headers['Retry-After'] = '5'
+    return response, 503
+
+def _ai_timeout_response():
+    """AI生成が時間内に終わらなかった場合のレスポンス"""
+    return jsonify({'success': False, 'error': 'AIの応答に時間がかかりすぎています。もう一度お試しください。'}), 504
+
+def _classify_ai_error(error_message):
+    """AI生成エラーをユーザー向けメッセージとHTTPステータスに変換"""
+    if "API_KEY_INVALID" in error_message or "invalid" in error_message.lower():
+        return 'APIキーが無効です', 400
+    elif "QUOTA_EXCEEDED" in error_message or "quota" in error_message.lower():
+        return 'APIの使用量制限に達しています', 429
+    elif "SAFETY" in error_message or "safety" in error_message.lower():
+        return 'コンテンツがAIの安全性フィルターに引っかかりました', 400
+    elif "permission" in error_message.lower() or "forbidden" in error_message.lower():
+        return 'APIキーに必要な権限がありません', 400
+    else:
+        return f'AI生成エラー: {error_message}', 500
+
+def _ai_result_response(user, text, content_type, cache_status, coalesced=False):
+    """AI生成結果のレスポンス（cache_status: HIT / MISS / BYPASS、coalesced: 同時リクエストの結果を共有したか）"""
+    response = jsonify({
+        'success': True,
+        'result': text,
+        'content_type': content_type,
+        'cached': cache_status == 'HIT',
+        'coalesced': coalesced,
+        'timestamp': datetime.now().isoformat(),
+        'usage_count': user.free_usage_count,
+        'usage_limit': 30
+    })
+    response.headers['X-AI-Cache'] = cache_status
+    if coalesced:
+        response.headers['X-AI-Coalesced'] = '1'
+    return response
+
+def _sse_event(event, payload):
+    """Server-Sent Eventsの1イベント分の文字列を作成"""
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
 @app.route('/api/ai-generate', methods=['POST'])
+@rate_limited('ai')
 @login_required
 def ai_generate():
     """AIプロンプトを実行して結果を取得（利用制限付き）"""
-    print(f"[DEBUG] AI API called - Request data: {request.get_json()}")
+    print(f"[DEBUG] AI API called - content_type: {(request.get_json() or {}).get('content_type')}")
     print(f"[DEBUG] Session user_id: {session.get('user_id')}")
     try:
         # 現在のユーザーを取得
@@ -620,139 +879,208 @@ def ai_generate():
         
         print(f"[DEBUG] User found: {user.email}, Premium: {user.is_premium}, Usage: {user.free_usage_count}/30")
         
-        # 利用制限チェック
-        usage_check = user.check_usage_limit()
-        print(f"[DEBUG] Usage limit check result: {usage_check}")
-        if not usage_check:
-            return jsonify({
-                'success': False,
-                'error': 'USAGE_LIMIT_EXCEEDED',
-                'message': f'無料利用回数（30回/月）を超過しました。現在の利用回数: {user.free_usage_count}/30',
-                'upgrade_url': 'https://www.smilefactory-rakuai.com/product-page/%E5%AD%A6%E7%BF%92%E6%8C%87%E5%B0%8E%E8%A6%81%E9%A0%98%E6%BA%96%E6%8B%A0-ai%E5%AD%A6%E7%BF%92%E3%82%A2%E3%83%97%E3%83%AA'
-            }), 429
+        ai_request, error_response = _parse_ai_request(request.get_json() or {})
+        if error_response:
+            return error_response
+        content_type = ai_request['content_type']
         
-        data = request.get_json()
-        prompt = data.get('prompt')
-        content_type = data.get('content_type', '')
-        context = data.get('context', {})  # コンテキスト情報を追加
-        
-        if not prompt:
-            return jsonify({'success': False, 'error': 'プロンプトが提供されていません'}), 400
-        
-        # サーバー統一APIキーを使用
-        print(f"[DEBUG] GEMINI_API_KEY exists: {bool(GEMINI_API_KEY)}")
-        if not GEMINI_API_KEY:
+        # サーバー統一APIキーを使用（ワーカーで共有するクライアント）
+        backend = get_ai_backend()
+        if backend is None:
             print("[ERROR] GEMINI_API_KEY is not set")
             return jsonify({'success': False, 'error': 'サーバーのAPIキーが設定されていません'}), 500
         
-        # Gemini APIを設定
-        print(f"[DEBUG] Using API key: {GEMINI_API_KEY[:10]}...{GEMINI_API_KEY[-5:]}")
-        genai.configure(api_key=GEMINI_API_KEY)
-        model = genai.GenerativeModel('gemini-2.5-flash')
+        # 定型プロンプトはキャッシュ済みの生成結果を返す（Geminiを呼ばないため利用枠も使わない）
+        fingerprint = _ai_request_fingerprint(ai_request, backend)
+        cache_ttl = cache_ttl_for(content_type, ai_request['identifier'])
+        cache_key = fingerprint if cache_ttl else None
+        if cache_key:
+            cached_text = ai_response_cache.get(cache_key)
+            if cached_text:
+                return _ai_result_response(user, cached_text, content_type, 'HIT')
         
-        # 基本的な優しいトーンの設定
-        base_tone = """
-あなたは不登校の子どもたちをサポートする優しい教育アシスタントです。
-常に温かく、理解のある態度で接し、プレッシャーを与えずに学習をサポートしてください。
-子どもたちのペースを尊重し、小さな進歩も褒めて励ましてください。
-        """
+        # 利用枠を予約（月次リセット・上限チェック・カウントアップを1回のUPDATEで実行）
+        if not user.reserve_usage():
+            return _usage_limit_response(user)
         
-        # コンテキストに基づいてプロンプトを構築
-        if context.get('page_type') == 'content':
-            # content画面用のコンテキスト情報
-            learning_objective = context.get('learning_objective', '')
-            subject = context.get('subject', '')
-            grade = context.get('grade', '')
-            keywords = context.get('keywords', [])
-            beginner_goals = context.get('beginner_goals', [])
-            intermediate_goals = context.get('intermediate_goals', [])
-            advanced_goals = context.get('advanced_goals', [])
+        try:
+            # カタログの学習内容に基づいてプロンプトを構築
+            enhanced_prompt = _build_enhanced_prompt(ai_request['prompt'], content_type, ai_request['context_text'])
             
-            context_info = f"""
-【現在の学習内容】
-• 教科: {subject}
-• 学年: {grade}年生
-• 学習目標: {learning_objective}
-• キーワード: {', '.join(keywords)}
-
-【学習ゴール】
-初心者レベル: {', '.join(beginner_goals)}
-中級者レベル: {', '.join(intermediate_goals)}
-上級者レベル: {', '.join(advanced_goals)}
-            """
+            def generate_text():
+                # AI生成実行（AI実行プールで実行し、リクエスト処理スレッドを長時間占有しない）
+                text = ai_executor.run(backend.generate, enhanced_prompt, timeout=AI_TIMEOUT)
+                if text and cache_key:
+                    ai_response_cache.set(cache_key, text, cache_ttl)
+                return text
             
-            enhanced_prompt = f"""
-{base_tone}
-
-{context_info}
-
-コンテンツタイプ: {content_type}
-
-{prompt}
-
-上記の学習内容とゴールを理解した上で、以下の観点から優しくアドバイスを提供してください：
-1. この学習内容に特化した具体的なアプローチ
-2. 必要な材料やツール（家庭にあるものを中心に）
-3. 無理をしないで進めるコツ
-4. 小さな達成感を味わえる工夫
-5. 学年に適した楽しい要素
-
-あなたならきっとできます！一歩ずつ、自分のペースで進めていきましょう。
-            """
+            # 同じプロンプトが生成中ならその結果を待つ（Gemini呼び出しは1回だけ）
+            text, coalesced = ai_single_flight.do(fingerprint, generate_text, timeout=AI_TIMEOUT)
+        except Exception:
+            # 生成に失敗した場合は予約した利用枠を取り消す
+            user.release_usage()
+            raise
+        
+        if text and coalesced:
+            # 他のリクエストの生成結果を共有した場合はGeminiを呼んでいないため、利用枠を取り消す
+            user.release_usage()
+        if text:
+            return _ai_result_response(user, text, content_type, 'MISS' if cache_key else 'BYPASS', coalesced)
         else:
-            # ホーム画面用（汎用的な優しいメッセージ）
-            enhanced_prompt = f"""
-{base_tone}
-
-{prompt}
+            user.release_usage()
+            return jsonify({'success': False, 'error': 'AIからの応答が空です'}), 500
+    
+    except AIBusyError:
+        return _ai_busy_response()
+    except TimeoutError:
+        return _ai_timeout_response()
+    except Exception as e:
+        error_message = str(e)
+        print(f"[ERROR] AI Generation Error: {error_message}")  # デバッグ用
+        import traceback
+        traceback.print_exc()  # スタックトレースを表示
+        
+        message, status = _classify_ai_error(error_message)
+        return jsonify({'success': False, 'error': message}), status
 
-あなたは学習について相談された優しい先生です。以下の点を心がけて回答してください：
-1. 無理をしないことの大切さを伝える
-2. 小さな一歩でも価値があることを伝える
-3. 具体的で実践しやすいアドバイス
-4. 励ましの言葉を忘れずに
+@app.route('/api/ai-generate-stream', methods=['POST'])
+@rate_limited('ai')
+@login_required
+def ai_generate_stream():
+    """AIプロンプトを実行し、生成途中のテキストをServer-Sent Eventsで逐次返す（利用制限付き）
 
-学習は競争ではありません。あなた自身のペースで、興味のあることから始めてみましょう。
-            """
-        
-        # AI生成実行
-        response = model.generate_content(enhanced_prompt)
-        
-        if response and response.text:
-            # 成功時に利用回数をカウントアップ
-            user.increment_usage_count()
+    イベント: chunk（{'text'}） → done（利用回数・キャッシュ利用有無等） / error（{'error'}）
+    利用枠はストリーム開始前に予約し、最後まで生成できなかった場合（エラー・切断）は取り消す
+    """
+    user = get_current_user()
+    if not user:
+        return jsonify({'success': False, 'error': 'ログインが必要です'}), 401
+    
+    ai_request, error_response = _parse_ai_request(request.get_json() or {})
+    if error_response:
+        return error_response
+    content_type = ai_request['content_type']
+    
+    backend = get_ai_backend()
+    if backend is None:
+        print("[ERROR] GEMINI_API_KEY is not set")
+        return jsonify({'success': False, 'error': 'サーバーのAPIキーが設定されていません'}), 500
+    
+    fingerprint = _ai_request_fingerprint(ai_request, backend)
+    cache_ttl = cache_ttl_for(content_type, ai_request['identifier'])
+    cache_key = fingerprint if cache_ttl else None
+    cached_text = ai_response_cache.get(cache_key) if cache_key else None
+    cache_status = 'HIT' if cached_text else ('MISS' if cache_key else 'BYPASS')
+    
+    # 利用枠を予約（Geminiを呼ぶ可能性がある場合のみ。ストリーム開始前に上限超過・DBエラーをJSONで返す）
+    if not cached_text:
+        try:
+            reserved = user.reserve_usage()
+        except Exception as e:
+            print(f"[ERROR] AI Stream Generation Error: {e}")
+            message, status = _classify_ai_error(str(e))
+            return jsonify({'success': False, 'error': message}), status
+        if not reserved:
+            return _usage_limit_response(user)
+    # released: 取り消すべき予約が無い（キャッシュ利用時は予約していない）
+    state = {'completed': False, 'released': bool(cached_text), 'follower_released': False}
+    
+    enhanced_prompt = _build_enhanced_prompt(ai_request['prompt'], content_type, ai_request['context_text'])
+    
+    flight, leader = None, False
+    if cached_text:
+        # キャッシュ済みの生成結果は1チャンクで返す（Geminiを呼ばない）
+        chunks = iter([cached_text])
+    else:
+        try:
+            flight, leader = ai_single_flight.begin(fingerprint)
+        except AIBusyError:
+            # 待機中のリクエストも上限に達している
+            user.release_usage()
+            return _ai_busy_response()
+        if leader:
+            # 満杯ならストリーム開始前に503を返す
+            try:
+                chunks = ai_executor.stream(backend.generate_stream, enhanced_prompt, timeout=AI_TIMEOUT)
+            except AIBusyError as e:
+                ai_single_flight.finish(fingerprint, flight, error=e)
+                user.release_usage()
+                return _ai_busy_response()
+        else:
+            # 同じプロンプトが生成中のため、その結果を待って1チャンクで返す
+            def wait_for_leader():
+                state['follower_released'] = True
+                text = ai_single_flight.wait(flight, timeout=AI_TIMEOUT)
+                if text:
+                    yield text
+            chunks = wait_for_leader()
+    
+    def generate():
+        received = []
+        try:
+            for text in chunks:
+                received.append(text)
+                yield _sse_event('chunk', {'text': text})
+            if leader:
+                # 待機中の同一プロンプトのリクエストに結果を渡す
+                ai_single_flight.finish(fingerprint, flight, result=''.join(received))
             
-            return jsonify({
+            if not received:
+                yield _sse_event('error', {'success': False, 'error': 'AIからの応答が空です'})
+                return
+            
+            if cache_status == 'MISS' and leader:
+                ai_response_cache.set(cache_key, ''.join(received), cache_ttl)
+            
+            if flight is not None and not leader:
+                # 他のリクエストの生成結果を共有した場合はGeminiを呼んでいないため、利用枠を取り消す
+                state['released'] = True
+                user.release_usage()
+            
+            # 最後まで生成できた場合のみ予約した利用枠を確定（途中切断時はGeneratorExitで中断）
+            state['completed'] = True
+            yield _sse_event('done', {
                 'success': True,
-                'result': response.text,
                 'content_type': content_type,
+                'cached': cache_status == 'HIT',
+                'coalesced': flight is not None and not leader,
                 'timestamp': datetime.now().isoformat(),
                 'usage_count': user.free_usage_count,
                 'usage_limit': 30
             })
-        else:
-            return jsonify({'success': False, 'error': 'AIからの応答が空です'}), 500
-            
-    except Exception as e:
-        error_message = str(e)
-        print(f"[ERROR] AI Generation Error: {error_message}")  # デバッグ用
-        import traceback
-        traceback.print_exc()  # スタックトレースを表示
-        
-        if "API_KEY_INVALID" in error_message or "invalid" in error_message.lower():
-            return jsonify({'success': False, 'error': 'APIキーが無効です'}), 400
-        elif "QUOTA_EXCEEDED" in error_message or "quota" in error_message.lower():
-            return jsonify({'success': False, 'error': 'APIの使用量制限に達しています'}), 429
-        elif "SAFETY" in error_message or "safety" in error_message.lower():
-            return jsonify({'success': False, 'error': 'コンテンツがAIの安全性フィルターに引っかかりました'}), 400
-        elif "permission" in error_message.lower() or "forbidden" in error_message.lower():
-            return jsonify({'success': False, 'error': 'APIキーに必要な権限がありません'}), 400
-        else:
-            return jsonify({'success': False, 'error': f'AI生成エラー: {error_message}'}), 500
+        except TimeoutError:
+            yield _sse_event('error', {'success': False, 'error': 'AIの応答に時間がかかりすぎています。もう一度お試しください。'})
+        except Exception as e:
+            print(f"[ERROR] AI Stream Generation Error: {e}")
+            message, _ = _classify_ai_error(str(e))
+            yield _sse_event('error', {'success': False, 'error': message})
+        finally:
+            finish_request()
+    
+    def finish_request():
+        """生成失敗・切断時は待機中のリクエストにエラーを渡し、予約した利用枠を取り消す（完了済みなら何もしない）"""
+        if leader:
+            ai_single_flight.finish(fingerprint, flight, error=RuntimeError('AI generation was interrupted'))
+        elif flight is not None and not state['follower_released']:
+            # 待機を始める前に切断された場合も、followerとして確保した実行枠を解放
+            state['follower_released'] = True
+            ai_single_flight.release()
+        if not state['completed'] and not state['released']:
+            state['released'] = True
+            user.release_usage()
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # プロキシでのバッファリングを無効化
+    response.headers['X-AI-Cache'] = cache_status
+    # ストリームが開始されずに閉じられた場合も合流待ちのリクエスト・利用枠を解放する
+    response.call_on_close(finish_request)
+    return response
 
 # ===== 認証エンドポイント =====
 
 @app.route('/login', methods=['GET', 'POST'])
+@rate_limited('login')
 def login():
     """ログイン処理"""
     if request.method == 'POST':
@@ -774,6 +1102,7 @@ def login():
     return render_template('login.html')
 
 @app.route('/register', methods=['GET', 'POST'])
+@rate_limited('register')
 def register():
     """ユーザー登録処理"""
     if request.method == 'POST':
@@ -982,40 +1311,33 @@ def reload_learning_data():
         if admin_key != 'admin123':
             return jsonify({'success': False, 'error': '管理者権限が必要です'}), 403
         
-        print("[API] 学習データの再読み込みを開始...")
+        print("[API] 学習データの差分再読み込みを開始...")
         
-        # 既存のlearning_itemsテーブルを削除
-        with db_manager.get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("DELETE FROM learning_items")
-                conn.commit()
-                print("[API] 既存のlearning_itemsデータを削除しました")
+        # 変更された行だけを1トランザクションでUPSERT（途中でテーブルが空になることはない）
+        result = sync_learning_data()
         
-        # 学習データを再読み込み
-        from database import _load_learning_data
-        _load_learning_data()
+        # このワーカーは即座に差し替え（他のワーカーはバージョン確認で差し替え）
+        viewer.refresh()
         
         # 結果を確認
-        with db_manager.get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("SELECT COUNT(*) FROM learning_items")
-                count = cur.fetchone()[0]
-                
-                # テスト用identifierの確認
-                cur.execute("SELECT identifier, subject FROM learning_items WHERE identifier = %s", ('8310213211100000',))
-                test_result = cur.fetchone()
-                
-                # 教科別件数確認
-                cur.execute("SELECT subject, COUNT(*) FROM learning_items GROUP BY subject ORDER BY subject")
-                subjects = cur.fetchall()
+        catalog = viewer.get_catalog()
+        test_item = viewer.get_item('8310213211100000')
+        subject_counts = {}
+        if catalog is not None:
+            for subject, items in catalog.items_by_subject.items():
+                subject_counts[subject] = len(items)
         
         return jsonify({
             'success': True,
             'message': f'学習データの再読み込みが完了しました',
-            'totalItems': count,
-            'testIdentifierFound': bool(test_result),
-            'testIdentifierSubject': test_result[1] if test_result else None,
-            'subjectCounts': {subject: count for subject, count in subjects}
+            'totalItems': len(catalog) if catalog is not None else 0,
+            'upsertedItems': result['upserted'],
+            'deletedItems': result['deleted'],
+            'rowErrors': result['errors'],
+            'catalogVersion': result['version'],
+            'testIdentifierFound': bool(test_item),
+            'testIdentifierSubject': test_item.subject if test_item else None,
+            'subjectCounts': subject_counts
         })
         
     except Exception as e:
@@ -1057,6 +1379,8 @@ def update_subject_names():
                     update_results.append(f"'{old_name}' → '{new_name}': {updated_count}件更新")
                     print(f"[API] '{old_name}' → '{new_name}': {updated_count}件更新")
                 
+                # 各ワーカーのカタログを差し替えるためバージョンを進める
+                bump_catalog_version(cur)
                 conn.commit()
                 
                 # 更新後の教科名を確認
@@ -1067,6 +1391,8 @@ def update_subject_names():
                 cur.execute("SELECT subject, COUNT(*) FROM learning_items GROUP BY subject ORDER BY subject")
                 subject_counts = {subject: count for subject, count in cur.fetchall()}
         
+        viewer.refresh()
+        
         return jsonify({
             'success': True,
             'message': '教科名の標準化が完了しました',
@@ -1082,5 +1408,11 @@ def update_subject_names():
         traceback.print_exc()
         return jsonify({'success': False, 'error': str(e)}), 500
 
+startup_report.print_report('Application imported')
+
 if __name__ == '__main__':
+    # ローカル開発ではスキーマ作成も起動時に行う
+    if os.environ.get('INIT_DB_ON_STARTUP') != '1':
+        if initialize_database():
+            viewer.refresh()
     app.run(debug=False, host='0.0.0.0', port=5000)
\ No newline at end of file
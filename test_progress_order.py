@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+進捗書き込みの行順序テスト
+upsert_progress_many がユーザーID・学習項目の昇順で書き込むこと（行ロックの順序が揃いデッドロックしないこと）を確認する
+DBには接続せず、SQLに渡すパラメータを記録するカーソルで確認する
+"""
+
+from datetime import datetime
+
+from progress import upsert_progress_many
+
+
+class RecordingCursor:
+    """executeに渡されたSQLとパラメータを記録するカーソル"""
+
+    def __init__(self):
+        self.executed = []
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+
+    def fetchall(self):
+        return []
+
+
+def _upsert_params(rows_by_user):
+    cur = RecordingCursor()
+    upsert_progress_many(cur, rows_by_user, datetime.now(), None)
+    return cur.executed[0][1]
+
+
+def test_upsert_progress_order():
+    """投入順に関係なく、ユーザーID・学習項目の昇順で書き込む"""
+    rows_by_user = {
+        42: [('M-2', 'beginnerGoals', 0, True), ('M-1', 'advancedGoals', 3, False)],
+        7: [('S-9', 'intermediateGoals', 1, True), ('K-1', 'beginnerGoals', 2, True), ('S-9', 'beginnerGoals', 0, True)],
+        15: [('A-1', 'beginnerGoals', 0, False)],
+    }
+    params = _upsert_params(rows_by_user)
+
+    print("=== 進捗書き込みの行順序テスト ===")
+    print(f"user_ids: {params['user_ids']}")
+    print(f"rows: {list(zip(params['row_user_ids'], params['items']))}")
+
+    assert params['user_ids'] == [7, 15, 42]
+    assert list(zip(params['row_user_ids'], params['items'])) == [
+        (7, 'K-1'), (7, 'S-9'), (15, 'A-1'), (42, 'M-1'), (42, 'M-2')
+    ]
+
+    # 逆の順序で渡しても同じ順序になる（同時に実行される2つの書き込みのロック順序が一致する）
+    reversed_params = _upsert_params(dict(reversed(list(rows_by_user.items()))))
+    assert reversed_params['user_ids'] == params['user_ids']
+    assert reversed_params['items'] == params['items']
+    print("OK: 投入順に関係なく同じ順序で書き込まれます")
+
+
+if __name__ == "__main__":
+    test_upsert_progress_order()
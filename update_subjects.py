@@ -15,7 +15,7 @@ load_dotenv()
 # プロジェクトのパスを追加
 sys.path.append(os.path.dirname(__file__))
 
-from database import db_manager
+from database import db_manager, bump_catalog_version
 
 def update_subject_names():
     """教科名を標準化"""
@@ -45,6 +45,8 @@ def update_subject_names():
                     updated_count = cur.rowcount
                     print(f"[UPDATE] '{old_name}' → '{new_name}': {updated_count}件更新")
                 
+                # 実行中のワーカーがカタログを差し替えるようにバージョンを進める
+                bump_catalog_version(cur)
                 conn.commit()
                 
                 # 更新後の教科名を確認